@@ -0,0 +1,109 @@
+import os
+import time
+import asyncio
+import hashlib
+from typing import Dict, Set, Tuple, Optional
+from models import AvailableModels
+import comfyui
+import workflows
+
+# Seconds a fetched catalog is served before a background refresh is started
+CATALOG_TTL = float(os.environ.get("COMFYSTUDIO_MODELS_TTL", "300"))
+
+# Loader inputs that are always listed, in addition to those the workflow maps reference
+DEFAULT_LOADERS = {
+    "CheckpointLoaderSimple": {"ckpt_name"},
+    "UNETLoader": {"unet_name"},
+    # i2v_wan22 uses UnetLoaderGGUF
+    "UnetLoaderGGUF": {"unet_name"},
+    "LoraLoader": {"lora_name"},
+}
+
+_catalog: Optional[AvailableModels] = None
+_etag: Optional[str] = None
+_fetched_at = 0.0
+_refresh_task: Optional[asyncio.Task] = None
+
+def _loader_fields() -> Dict[str, Set[str]]:
+    """class_type -> input names to list, from the defaults plus every workflow's model/LoRA node."""
+    fields = {cls: set(names) for cls, names in DEFAULT_LOADERS.items()}
+    for template in workflows.get_templates():
+        for node_id, field in ((template.model, template.model_field), (template.lora, template.lora_field)):
+            if not node_id or not field:
+                continue
+            class_type = template.data[node_id].get("class_type")
+            if class_type:
+                fields.setdefault(class_type, set()).add(field)
+    return fields
+
+def _choices(info: Dict, class_type: str, field: str) -> list:
+    inputs = info.get(class_type, {}).get("input", {})
+    spec = inputs.get("required", {}).get(field) or inputs.get("optional", {}).get(field)
+    if not spec:
+        return []
+    if isinstance(spec[0], list):
+        return spec[0]
+    # Newer ComfyUI: ["COMBO", {"options": [...]}]
+    if spec[0] == "COMBO" and len(spec) > 1 and isinstance(spec[1], dict):
+        return spec[1].get("options", [])
+    return []
+
+def parse_loaders(info: Dict, fields: Dict[str, Set[str]]) -> AvailableModels:
+    loaders = {}
+    checkpoints, unets, loras = set(), set(), set()
+    for class_type, names in fields.items():
+        for field in names:
+            values = _choices(info, class_type, field)
+            loaders[f"{class_type}.{field}"] = values
+            if "ckpt" in field:
+                checkpoints.update(values)
+            elif "unet" in field:
+                unets.update(values)
+            elif "lora" in field:
+                loras.update(values)
+    return AvailableModels(
+        checkpoints=sorted(checkpoints), unets=sorted(unets), loras=sorted(loras), loaders=loaders
+    )
+
+async def _fetch() -> AvailableModels:
+    fields = _loader_fields()
+    server = comfyui.default_server()
+    # Only the loader classes we need, instead of the multi-MB full /object_info
+    results = await asyncio.gather(
+        *(comfyui.get_object_info(cls, server=server) for cls in fields), return_exceptions=True
+    )
+    info = {}
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+        info.update(result)
+    return parse_loaders(info, fields)
+
+async def refresh() -> AvailableModels:
+    """Fetches the catalog now. On failure the previous catalog is kept."""
+    global _catalog, _etag, _fetched_at
+    try:
+        catalog = await _fetch()
+    except Exception as e:
+        print(f"Error fetching models: {e}")
+        return _catalog or AvailableModels()
+    _catalog = catalog
+    _etag = '"%s"' % hashlib.sha256(catalog.model_dump_json().encode()).hexdigest()[:32]
+    _fetched_at = time.monotonic()
+    return catalog
+
+def _refresh_in_background():
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(refresh())
+
+async def get_catalog() -> Tuple[AvailableModels, Optional[str]]:
+    """Returns (catalog, etag). Stale entries are served while a refresh runs in the background."""
+    if _catalog is None:
+        if _refresh_task is not None and not _refresh_task.done():
+            await _refresh_task
+        else:
+            await refresh()
+    elif time.monotonic() - _fetched_at > CATALOG_TTL:
+        _refresh_in_background()
+    return _catalog or AvailableModels(), _etag
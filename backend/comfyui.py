@@ -1,97 +1,501 @@
 import json
-import urllib.request
-import urllib.parse
+import os
 import uuid
+import struct
+import time
+import hashlib
 import asyncio
+import httpx
 import websockets
-from typing import Dict, Any
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, List, Tuple, Optional
+import metrics
 
 COMFYUI_SERVER = "127.0.0.1:8188"
+# Comma-separated host:port list of ComfyUI instances to spread generations over
+COMFYUI_SERVERS = [s.strip() for s in os.environ.get("COMFYUI_SERVERS", COMFYUI_SERVER).split(",") if s.strip()]
 CLIENT_ID = str(uuid.uuid4())
 
-def queue_prompt(prompt: Dict[str, Any]) -> str:
-    """Queues a prompt to the ComfyUI server and returns the prompt_id."""
-    p = {"prompt": prompt, "client_id": CLIENT_ID}
-    data = json.dumps(p).encode('utf-8')
-    req = urllib.request.Request(f"http://{COMFYUI_SERVER}/prompt", data=data)
+# Seconds between /queue health checks of every backend
+HEALTH_CHECK_INTERVAL = float(os.environ.get("COMFYSTUDIO_HEALTH_CHECK_INTERVAL", "5"))
+HEALTH_CHECK_TIMEOUT = 3.0
+# A backend that already has the model loaded is preferred unless its queue is
+# this many prompts deeper than the least busy backend
+AFFINITY_MAX_EXTRA_DEPTH = int(os.environ.get("COMFYSTUDIO_AFFINITY_MAX_EXTRA_DEPTH", "2"))
+
+# Reconnect backoff bounds (seconds) for the shared websocket
+WS_RECONNECT_MIN = 0.5
+WS_RECONNECT_MAX = 30.0
+# How many finished prompt ids to remember for watchers that register late
+FINISHED_PROMPTS_KEPT = 1024
+
+# Binary websocket frames start with a big-endian uint32 event type
+BINARY_PREVIEW_IMAGE = 1
+BINARY_PREVIEW_IMAGE_WITH_METADATA = 4
+# PREVIEW_IMAGE frames follow the event type with a uint32 image type
+PREVIEW_IMAGE_TYPES = {1: "image/jpeg", 2: "image/png"}
+
+# HTTP client settings: read timeout (seconds), retry count and base backoff for transient failures
+HTTP_TIMEOUT = float(os.environ.get("COMFYSTUDIO_HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("COMFYSTUDIO_HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_RETRIES = int(os.environ.get("COMFYSTUDIO_HTTP_RETRIES", "3"))
+HTTP_BACKOFF = 0.5
+HTTP_MAX_CONNECTIONS = 20
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+_http: httpx.AsyncClient = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared keep-alive connection pool used for every ComfyUI HTTP call."""
+    global _http
+    if _http is None or _http.is_closed:
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+        )
+    return _http
+
+async def close_http_client():
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+def _is_retryable(e: Exception, idempotent: bool) -> bool:
+    if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        # Nothing reached the server, safe to retry anything
+        return True
+    if not idempotent:
+        return False
+    if isinstance(e, httpx.TransportError):
+        return True
+    return isinstance(e, httpx.HTTPStatusError) and e.response.status_code >= 500
+
+async def _with_retries(fn, idempotent: bool = True, retries: int = None):
+    """Runs an async request function, retrying transient failures with exponential backoff."""
+    retries = HTTP_RETRIES if retries is None else retries
+    delay = HTTP_BACKOFF
+    for attempt in range(retries + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= retries or not _is_retryable(e, idempotent):
+                raise
+            await asyncio.sleep(delay)
+            delay *= 2
+
+async def _request(method: str, path: str, idempotent: bool = True, server: str = None, retries: int = None, **kwargs) -> httpx.Response:
+    server = server or default_server()
+    async def send():
+        r = await get_http_client().request(method, f"http://{server}{path}", **kwargs)
+        r.raise_for_status()
+        return r
+    return await _with_retries(send, idempotent, retries)
+
+class Backend:
+    """Dispatch state for one ComfyUI instance of the pool."""
+    def __init__(self, server: str):
+        self.server = server
+        self.healthy = True
+        # Prompts running or pending on the server, from /queue plus our submissions since
+        self.queue_depth = 0
+        # Model of the last prompt we sent; ComfyUI keeps it loaded until another one replaces it
+        self.last_model = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"server": self.server, "healthy": self.healthy, "queue_depth": self.queue_depth, "last_model": self.last_model}
+
+BACKENDS: Dict[str, Backend] = {}
+
+def get_backends() -> List[Backend]:
+    if not BACKENDS:
+        for server in COMFYUI_SERVERS:
+            BACKENDS[server] = Backend(server)
+    return list(BACKENDS.values())
+
+def default_server() -> str:
+    """A server for calls that aren't tied to a specific prompt."""
+    backends = get_backends()
+    healthy = [b for b in backends if b.healthy]
+    return (healthy or backends)[0].server
+
+def pick_backend(model: str = None, exclude=()) -> Optional[Backend]:
+    """Least-queue-depth backend, preferring one that last ran model."""
+    candidates = [b for b in get_backends() if b.server not in exclude]
+    healthy = [b for b in candidates if b.healthy]
+    # If everything looks down, still try rather than failing outright
+    candidates = healthy or candidates
+    if not candidates:
+        return None
+    least = min(candidates, key=lambda b: b.queue_depth)
+    if model:
+        warm = [b for b in candidates if b.last_model == model]
+        if warm:
+            best_warm = min(warm, key=lambda b: b.queue_depth)
+            if best_warm.queue_depth - least.queue_depth <= AFFINITY_MAX_EXTRA_DEPTH:
+                return best_warm
+    return least
+
+def _queue_depth(data: Dict[str, Any]) -> int:
+    return len(data.get("queue_running", [])) + len(data.get("queue_pending", []))
+
+async def check_backend(backend: Backend):
     try:
-        response = urllib.request.urlopen(req)
-        response_data = json.loads(response.read())
-        return response_data.get("prompt_id")
+        r = await get_http_client().get(f"http://{backend.server}/queue", timeout=HEALTH_CHECK_TIMEOUT)
+        r.raise_for_status()
+        backend.queue_depth = _queue_depth(r.json())
+        if not backend.healthy:
+            print(f"ComfyUI backend {backend.server} is back")
+        backend.healthy = True
     except Exception as e:
-        print(f"Error queuing prompt: {e}")
-        return None
+        if backend.healthy:
+            print(f"ComfyUI backend {backend.server} is unhealthy: {e}")
+        backend.healthy = False
+
+async def run_health_checks(interval: float = None):
+    """Background task that refreshes health and queue depth of every backend."""
+    interval = interval or HEALTH_CHECK_INTERVAL
+    while True:
+        await asyncio.gather(*(check_backend(b) for b in get_backends()))
+        await asyncio.sleep(interval)
+
+async def queue_prompt(prompt: Dict[str, Any], model: str = None) -> Tuple[Optional[str], Optional[str]]:
+    """Queues a prompt on the best backend, failing over to the others.
+
+    Returns (prompt_id, server), or (None, None) if no backend accepted it.
+    """
+    p = {"prompt": prompt, "client_id": CLIENT_ID}
+    tried = set()
+    while True:
+        backend = pick_backend(model, exclude=tried)
+        if backend is None:
+            return None, None
+        tried.add(backend.server)
+        # Make sure the websocket is up before the prompt can start reporting
+        get_connection(backend.server)
+        # While other backends are left, failing over beats backing off on one that is down
+        retries = 0 if any(b.server not in tried for b in get_backends()) else None
+        # Counted before the POST so submissions made meanwhile pick other backends
+        backend.queue_depth += 1
+        try:
+            response = await _request("POST", "/prompt", idempotent=False, server=backend.server, retries=retries, json=p)
+            prompt_id = response.json().get("prompt_id")
+        except Exception as e:
+            print(f"Error queuing prompt on {backend.server}: {e}")
+            if isinstance(e, httpx.TransportError):
+                backend.healthy = False
+            prompt_id = None
+        if prompt_id:
+            if model:
+                backend.last_model = model
+            return prompt_id, backend.server
+        backend.queue_depth = max(backend.queue_depth - 1, 0)
+
+async def download_image(filename: str, subfolder: str, folder_type: str, dest: Path, server: str = None) -> Optional[str]:
+    """Streams an output file from the ComfyUI server to dest in chunks.
+
+    Returns the SHA-256 hex digest of the file, hashed on the way through, or
+    None if it couldn't be fetched.
+    """
+    params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+    tmp = dest.with_name(dest.name + ".part")
+    server = server or default_server()
+
+    async def fetch():
+        written = 0
+        write_time = 0.0
+        digest = hashlib.sha256()
+        async with get_http_client().stream("GET", f"http://{server}/view", params=params) as response:
+            response.raise_for_status()
+            with open(tmp, "wb") as f:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    started = time.perf_counter()
+                    f.write(chunk)
+                    write_time += time.perf_counter() - started
+                    digest.update(chunk)
+                    written += len(chunk)
+        os.replace(tmp, dest)
+        metrics.DOWNLOAD_BYTES.inc(written)
+        metrics.record(metrics.GENERATION_STAGE_SECONDS, "disk_write", write_time)
+        return digest.hexdigest()
 
-def get_image(filename: str, subfolder: str, folder_type: str) -> bytes:
-    """Fetches an image from the ComfyUI server."""
-    data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    url_values = urllib.parse.urlencode(data)
-    req = urllib.request.Request(f"http://{COMFYUI_SERVER}/view?{url_values}")
     try:
-        with urllib.request.urlopen(req) as response:
-            return response.read()
+        return await _with_retries(fetch)
     except Exception as e:
         print(f"Error fetching image: {e}")
+        if tmp.exists():
+            tmp.unlink()
         return None
 
-async def listen_for_progress(prompt_id: str, callback=None, timeout: int = 600) -> bool:
-    """Listens to the ComfyUI websocket for progress on a specific prompt_id."""
-    ws_url = f"ws://{COMFYUI_SERVER}/ws?clientId={CLIENT_ID}"
+def decode_preview(frame: bytes) -> Optional[Tuple[str, bytes, Optional[str]]]:
+    """Decodes a binary websocket frame into (mime type, image bytes, prompt id).
+
+    Plain PREVIEW_IMAGE frames don't say which prompt they belong to, so the
+    prompt id is None and the caller attributes them to the executing prompt.
+    Returns None for frames that aren't previews.
+    """
+    if len(frame) < 8:
+        return None
+    event, = struct.unpack(">I", frame[:4])
+    if event == BINARY_PREVIEW_IMAGE:
+        image_type, = struct.unpack(">I", frame[4:8])
+        mime = PREVIEW_IMAGE_TYPES.get(image_type)
+        return (mime, frame[8:], None) if mime else None
+    if event == BINARY_PREVIEW_IMAGE_WITH_METADATA:
+        # uint32 metadata length, JSON metadata, then the encoded image
+        size, = struct.unpack(">I", frame[4:8])
+        try:
+            metadata = json.loads(frame[8:8 + size])
+        except ValueError:
+            return None
+        return metadata.get("image_type", "image/jpeg"), frame[8 + size:], metadata.get("prompt_id")
+    return None
+
+class PromptWatch:
+    """Per-prompt routing target: a queue of websocket messages plus a completion future."""
+    def __init__(self):
+        self.events = asyncio.Queue()
+        self.done = asyncio.get_running_loop().create_future()
+        # Called with (mime type, image bytes) for each sampler preview frame
+        self.on_preview = None
+
+    def finish(self, success: bool):
+        if not self.done.done():
+            self.done.set_result(success)
+            self.events.put_nowait({"type": "done", "data": {"success": success}})
+
+class ComfyConnection:
+    """Single long-lived websocket to one ComfyUI server, shared by every generation.
+
+    Messages are routed by prompt_id to registered PromptWatch objects. Prompts that
+    finish before anyone registers are remembered so a late watch resolves at once.
+    """
+    def __init__(self, server: str, client_id: str):
+        self.server = server
+        self.client_id = client_id
+        self.watchers: Dict[str, PromptWatch] = {}
+        self.finished: "OrderedDict[str, bool]" = OrderedDict()
+        # Prompt currently executing on this server; binary previews belong to it
+        self.executing: Optional[str] = None
+        self.connected = asyncio.Event()
+        self._task = None
+        self._history_check = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._task, self._history_check):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._history_check = None
+        self.connected.clear()
+
+    def watch(self, prompt_id: str) -> PromptWatch:
+        w = self.watchers.get(prompt_id)
+        if w is None:
+            w = PromptWatch()
+            self.watchers[prompt_id] = w
+            if prompt_id in self.finished:
+                w.finish(self.finished[prompt_id])
+        return w
+
+    def unwatch(self, prompt_id: str):
+        self.watchers.pop(prompt_id, None)
+
+    def _finish(self, prompt_id: str, success: bool):
+        if self.executing == prompt_id:
+            self.executing = None
+        self.finished[prompt_id] = success
+        self.finished.move_to_end(prompt_id)
+        while len(self.finished) > FINISHED_PROMPTS_KEPT:
+            self.finished.popitem(last=False)
+        w = self.watchers.get(prompt_id)
+        if w:
+            w.finish(success)
+
+    async def _check_history(self, prompt_id: str):
+        history = await get_history(prompt_id, server=self.server)
+        entry = history.get(prompt_id)
+        # ComfyUI only writes history once a prompt is done, failed ones included
+        if entry is not None and prompt_id in self.watchers:
+            status = entry.get("status") or {}
+            self._finish(prompt_id, status.get("status_str", "success") != "error")
+
+    async def _resolve_from_history(self, prompt_ids: List[str]):
+        """Finishes watched prompts that ended while the socket was down; their events are gone."""
+        await asyncio.gather(*(self._check_history(prompt_id) for prompt_id in prompt_ids))
+
+    def _dispatch(self, message: Dict[str, Any]):
+        msg_type = message.get("type")
+        data = message.get("data") or {}
+        if msg_type == "status":
+            # Broadcast whenever the server's queue changes
+            remaining = data.get("status", {}).get("exec_info", {}).get("queue_remaining")
+            backend = BACKENDS.get(self.server)
+            if backend is not None and remaining is not None:
+                backend.queue_depth = remaining
+            return
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+        if msg_type == "execution_start" or (msg_type == "executing" and data.get("node") is not None):
+            self.executing = prompt_id
+        if msg_type == "executing" and data.get("node") is None:
+            # Execution is done
+            self._finish(prompt_id, True)
+        elif msg_type in ("execution_error", "execution_interrupted"):
+            self._finish(prompt_id, False)
+        elif msg_type in ("executing", "progress", "executed"):
+            w = self.watchers.get(prompt_id)
+            if w:
+                w.events.put_nowait(message)
+
+    def _dispatch_binary(self, frame: bytes):
+        preview = decode_preview(frame)
+        if preview is None:
+            return
+        mime, image, prompt_id = preview
+        w = self.watchers.get(prompt_id or self.executing)
+        if w and w.on_preview:
+            try:
+                w.on_preview(mime, image)
+            except Exception as e:
+                print(f"Error handling preview: {e}")
+
+    async def _run(self):
+        ws_url = f"ws://{self.server}/ws?clientId={self.client_id}"
+        backoff = WS_RECONNECT_MIN
+        while True:
+            try:
+                async with websockets.connect(ws_url) as ws:
+                    self.connected.set()
+                    backoff = WS_RECONNECT_MIN
+                    # Anything that finishes from here on is reported on this socket
+                    if self.watchers:
+                        self._history_check = asyncio.create_task(self._resolve_from_history(list(self.watchers)))
+                    async for out in ws:
+                        if isinstance(out, str):
+                            self._dispatch(json.loads(out))
+                        else:
+                            self._dispatch_binary(out)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Websocket error ({self.server}): {e}, reconnecting in {backoff:.1f}s")
+            self.connected.clear()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, WS_RECONNECT_MAX)
+
+_connections: Dict[str, ComfyConnection] = {}
+
+def get_connection(server: str = None) -> ComfyConnection:
+    """Returns the shared connection for a server, starting it on first use."""
+    server = server or default_server()
+    conn = _connections.get(server)
+    if conn is None:
+        conn = ComfyConnection(server, CLIENT_ID)
+        _connections[server] = conn
+    conn.start()
+    return conn
+
+async def close_connections():
+    for conn in _connections.values():
+        await conn.stop()
+    _connections.clear()
+
+def start_connections():
+    """Opens the shared websocket of every backend."""
+    for b in get_backends():
+        get_connection(b.server)
+
+async def listen_for_progress(prompt_id: str, callback=None, timeout: int = 600, server: str = None, preview_callback=None, start_callback=None) -> bool:
+    """Waits on the shared websocket for a prompt to finish, forwarding progress to callback.
+
+    preview_callback(mime, image) is called synchronously for every sampler preview frame,
+    start_callback() once when the prompt starts executing.
+    """
+    conn = get_connection(server)
+    watch = conn.watch(prompt_id)
+    watch.on_preview = preview_callback
     try:
-        async with websockets.connect(ws_url) as ws:
-            while True:
-                out = await asyncio.wait_for(ws.recv(), timeout=timeout)
-                if isinstance(out, str):
-                    message = json.loads(out)
-                    if message['type'] == 'executing':
-                        data = message['data']
-                        if data['node'] is None and data['prompt_id'] == prompt_id:
-                            # Execution is done
-                            return True 
-                    elif message['type'] == 'progress':
-                        if callback:
-                            await callback(message['data'])
-                            
+        while True:
+            message = await asyncio.wait_for(watch.events.get(), timeout=timeout)
+            if message['type'] == 'done':
+                return message['data']['success']
+            elif message['type'] == 'executing':
+                if start_callback:
+                    start_callback()
+                    start_callback = None
+            elif message['type'] == 'progress':
+                if callback:
+                    await callback(message['data'])
     except asyncio.TimeoutError:
         print(f"Websocket timeout waiting for prompt {prompt_id}")
         return False
+    finally:
+        conn.unwatch(prompt_id)
+
+async def get_queue_prompt_ids(server: str = None):
+    """Returns the ids of running and pending prompts, or None if the queue can't be read."""
+    try:
+        response = await _request("GET", "/queue", server=server)
+        data = response.json()
     except Exception as e:
-        print(f"Websocket error: {e}")
+        print(f"Error getting queue: {e}")
+        return None
+    # Entries are [number, prompt_id, prompt, extra_data, outputs_to_execute]
+    running = {item[1] for item in data.get("queue_running", [])}
+    pending = {item[1] for item in data.get("queue_pending", [])}
+    return running | pending
+
+async def cancel_prompt(prompt_id: str, server: str = None) -> bool:
+    """Removes a pending prompt from ComfyUI's queue, or interrupts it if it is executing."""
+    try:
+        response = await _request("GET", "/queue", server=server)
+        data = response.json()
+        running = {item[1] for item in data.get("queue_running", [])}
+        pending = {item[1] for item in data.get("queue_pending", [])}
+        if prompt_id in pending:
+            await _request("POST", "/queue", server=server, json={"delete": [prompt_id]})
+        if prompt_id in running:
+            # Only interrupt when it is ours; older ComfyUI ignores prompt_id and stops whatever is running
+            await _request("POST", "/interrupt", idempotent=False, server=server, json={"prompt_id": prompt_id})
+        return True
+    except Exception as e:
+        print(f"Error cancelling prompt {prompt_id}: {e}")
         return False
-    
-    return False
 
-def get_history(prompt_id: str) -> Dict[str, Any]:
+async def interrupt(server: str = None) -> bool:
+    """Interrupts whatever is executing on one backend, or on every backend if server is None."""
+    servers = [server] if server else [b.server for b in get_backends()]
+    ok = True
+    for s in servers:
+        try:
+            await _request("POST", "/interrupt", idempotent=False, server=s)
+        except Exception as e:
+            print(f"Error interrupting ComfyUI {s}: {e}")
+            ok = False
+    return ok
+
+async def get_history(prompt_id: str, server: str = None) -> Dict[str, Any]:
     """Gets the history/results for a given prompt_id."""
-    req = urllib.request.Request(f"http://{COMFYUI_SERVER}/history/{prompt_id}")
     try:
-        with urllib.request.urlopen(req) as response:
-            return json.loads(response.read())
+        response = await _request("GET", f"/history/{prompt_id}", server=server)
+        return response.json()
     except Exception as e:
         print(f"Error getting history: {e}")
         return {}
 
-def get_available_models() -> Dict[str, list]:
-    """Fetches available checkpoints and unets from ComfyUI."""
-    req = urllib.request.Request(f"http://{COMFYUI_SERVER}/object_info")
-    try:
-        with urllib.request.urlopen(req) as response:
-            data = json.loads(response.read())
-            checkpoints = data.get('CheckpointLoaderSimple',{}).get('input',{}).get('required',{}).get('ckpt_name',[[]])[0]
-            unets = data.get('UNETLoader',{}).get('input',{}).get('required',{}).get('unet_name',[[]])[0]
-            # i2v_wan22 uses UnetLoaderGGUF but we could also add that if needed:
-            gguf_unets = data.get('UnetLoaderGGUF',{}).get('input',{}).get('required',{}).get('unet_name',[[]])[0]
-            
-            # Combine unets
-            all_unets = list(set(unets + gguf_unets))
-            
-            loras = data.get('LoraLoader',{}).get('input',{}).get('required',{}).get('lora_name',[[]])[0]
-            
-            return {
-                "checkpoints": checkpoints,
-                "unets": all_unets,
-                "loras": loras
-            }
-    except Exception as e:
-        print(f"Error fetching models: {e}")
-        return {"checkpoints": [], "unets": []}
+async def get_object_info(node_class: str, server: str = None) -> Dict[str, Any]:
+    """Fetches the /object_info entry of one node class, or {} if it isn't installed."""
+    response = await _request("GET", f"/object_info/{node_class}", server=server)
+    # Parse off the event loop; entries can still be large
+    return await asyncio.to_thread(json.loads, response.content)
@@ -0,0 +1,27 @@
+import os
+import sqlite3
+from pathlib import Path
+import projects
+
+def path(name: str) -> Path:
+    """Location of a database file under the projects directory."""
+    return projects.PROJECTS_DIR / name
+
+def connect(db_path: Path) -> sqlite3.Connection:
+    """Opens a SQLite database shared by the event loop and worker threads.
+
+    Autocommit (callers open their own transactions), rows as sqlite3.Row, and
+    WAL so readers don't block the writer.
+    """
+    os.makedirs(db_path.parent, exist_ok=True)
+    db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+def add_column(db: sqlite3.Connection, table: str, column: str, decl: str):
+    """Adds a column that databases created by older versions lack."""
+    columns = {row["name"] for row in db.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
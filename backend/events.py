@@ -0,0 +1,89 @@
+import json
+import asyncio
+from typing import Dict, Set, Any
+from models import GenerationNode
+
+# Per-subscriber backlog. When a slow client falls this far behind, new
+# progress/preview events are dropped (a later one supersedes them anyway);
+# any other event closes the stream instead, and the client resyncs on reconnect.
+QUEUE_SIZE = 256
+TRANSIENT_EVENTS = {"progress", "preview"}
+# Seconds between keep-alive comments on idle streams
+KEEPALIVE_INTERVAL = 15.0
+
+SUBSCRIBERS: Dict[str, Set[asyncio.Queue]] = {}
+# Queued in place of the backlog of a subscriber whose stream has to end
+_END = {"type": None}
+# Set while the server shuts down; no new stream is kept open then
+_closing = False
+
+def subscribe(project_id: str) -> asyncio.Queue:
+    q = asyncio.Queue(maxsize=QUEUE_SIZE)
+    SUBSCRIBERS.setdefault(project_id, set()).add(q)
+    if _closing:
+        _end(project_id, q)
+    return q
+
+def unsubscribe(project_id: str, q: asyncio.Queue):
+    subs = SUBSCRIBERS.get(project_id)
+    if subs:
+        subs.discard(q)
+        if not subs:
+            del SUBSCRIBERS[project_id]
+
+def _end(project_id: str, q: asyncio.Queue):
+    """Makes a subscriber's stream return, discarding whatever it hasn't sent yet."""
+    while not q.empty():
+        q.get_nowait()
+    q.put_nowait(_END)
+    unsubscribe(project_id, q)
+
+def open_streams():
+    global _closing
+    _closing = False
+
+def close_streams():
+    """Ends every open stream, so the server doesn't wait on them to shut down.
+
+    Clients reconnect and resync once the server is back.
+    """
+    global _closing
+    _closing = True
+    for project_id, subs in list(SUBSCRIBERS.items()):
+        for q in list(subs):
+            _end(project_id, q)
+
+def publish(project_id: str, event_type: str, node_id: str, **data: Any):
+    """Fans an event for one node out to every subscriber of the project."""
+    subs = SUBSCRIBERS.get(project_id)
+    if not subs:
+        return
+    event = {"type": event_type, "node_id": node_id, **data}
+    for q in list(subs):
+        if not q.full():
+            q.put_nowait(event)
+        elif event_type not in TRANSIENT_EVENTS:
+            # Dropping this would leave the client with a stale node; drop the client
+            _end(project_id, q)
+
+def publish_node(project_id: str, event_type: str, node: GenerationNode):
+    """Publishes an event carrying the full node (queued, completed, error)."""
+    if SUBSCRIBERS.get(project_id):
+        publish(project_id, event_type, node.id, node=node.model_dump())
+
+async def stream(project_id: str):
+    """Yields Server-Sent Events for a project until the client disconnects or the server shuts down."""
+    q = subscribe(project_id)
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(q.get(), timeout=KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is _END:
+                return
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        unsubscribe(project_id, q)
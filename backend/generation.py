@@ -0,0 +1,180 @@
+import time
+from models import GenerationNode
+import projects
+import comfyui
+import workflows
+import events
+import media
+import previews
+import results
+import metrics
+from metrics import GENERATION_STAGE_SECONDS as STAGES
+
+def fail_node(project_id: str, node: GenerationNode, error: str) -> bool:
+    """Marks a generating node failed. Returns False if it already completed, failed or was cancelled."""
+    node = projects.update_node(project_id, node.id, expect_status="generating", status="error", error=error)
+    if node is None:
+        return False
+    events.publish_node(project_id, "error", node)
+    metrics.GENERATIONS.inc(result="error")
+    return True
+
+def complete_node(project_id: str, node: GenerationNode, filename: str, cached: bool = False) -> bool:
+    """Marks a generating node completed. Returns False if it was cancelled or failed meanwhile."""
+    node = projects.update_node(
+        project_id, node.id, expect_status="generating",
+        image_filename=filename, status="completed", progress=1.0,
+    )
+    if node is None:
+        return False
+    metrics.GENERATIONS.inc(result="cached" if cached else "completed")
+    events.publish_node(project_id, "completed", node)
+    media.schedule_derivatives(project_id, filename)
+    return True
+
+async def run_generation(project_id: str, node: GenerationNode, on_queued=None):
+    """Builds and queues the prompt for node, then waits for and stores its output.
+
+    on_queued(prompt_id, server) is called as soon as a ComfyUI backend accepts the prompt.
+    """
+    wf_name = node.params.workflow
+    with metrics.stage(STAGES, "build"):
+        template = workflows.get_template(wf_name)
+        # Inject params (copies only the nodes it changes)
+        workflow = template.build(node.params) if template else None
+    
+    if template is None:
+        print(f"Workflow {wf_name} not found in registry")
+        fail_node(project_id, node, f"Workflow {wf_name} not found.")
+        return
+
+    # An identical prompt graph was rendered before: reuse its output without touching ComfyUI
+    with metrics.stage(STAGES, "cache_lookup"):
+        cache_key = results.prompt_key(workflow, template.save)
+        cached = await results.restore(cache_key, projects.get_project_dir(project_id), node.id)
+    if cached:
+        filename, sha256 = cached
+        if sha256:
+            await media.record_etag(project_id, filename, sha256)
+        complete_node(project_id, node, filename, cached=True)
+        return
+    
+    # Queue prompt
+    # The model is used to route to a backend that already has it loaded
+    with metrics.stage(STAGES, "queue_prompt"):
+        prompt_id, server = await comfyui.queue_prompt(workflow, model=node.params.model or None)
+    if not prompt_id:
+        fail_node(project_id, node, "Failed to queue prompt to ComfyUI.")
+        return
+    if on_queued:
+        on_queued(prompt_id, server)
+
+    await finish_generation(project_id, node, prompt_id, template.save, server, cache_key)
+
+async def resume_generation(project_id: str, node: GenerationNode, prompt_id: str, server: str = None) -> bool:
+    """Picks up a prompt queued before a restart.
+
+    Returns False when ComfyUI no longer knows the prompt (neither in history
+    nor in its queue), in which case the caller should queue it again.
+    """
+    template = workflows.get_template(node.params.workflow)
+    if template is None:
+        fail_node(project_id, node, f"Workflow {node.params.workflow} not found.")
+        return True
+    history = await comfyui.get_history(prompt_id, server=server)
+    if prompt_id not in history:
+        queued = await comfyui.get_queue_prompt_ids(server=server)
+        if queued is not None and prompt_id not in queued:
+            return False
+    cache_key = results.prompt_key(template.build(node.params), template.save)
+    await finish_generation(project_id, node, prompt_id, template.save, server, cache_key)
+    return True
+
+async def finish_generation(project_id: str, node: GenerationNode, prompt_id: str, save_node_id: str, server: str = None, cache_key: str = None):
+    """Waits for a queued prompt to finish and downloads its output into the project.
+
+    The output is added to the result cache under cache_key when one is given.
+    """
+    metrics.PROMPTS_IN_FLIGHT.inc()
+    try:
+        await _finish_generation(project_id, node, prompt_id, save_node_id, server, cache_key)
+    finally:
+        metrics.PROMPTS_IN_FLIGHT.dec()
+
+async def _finish_generation(project_id, node, prompt_id, save_node_id, server, cache_key):
+    waiting_since = time.perf_counter()
+    started_at = None
+
+    def start_callback():
+        nonlocal started_at
+        started_at = time.perf_counter()
+        metrics.record(STAGES, "queue_wait", started_at - waiting_since)
+
+    async def progress_callback(data):
+        val = data.get('value', 0)
+        max_val = data.get('max', 1)
+        progress = val / max_val if max_val > 0 else 0
+        # Progress is transient: keep it in memory only
+        if projects.update_node(project_id, node.id, persist=False, expect_status="generating", progress=progress):
+            events.publish(project_id, "progress", node.id, progress=progress)
+
+    def preview_callback(mime, image):
+        previews.put(project_id, node.id, mime, image)
+
+    # Register with the shared websocket first so completion events can't slip by,
+    # then check history in case the prompt finished while the socket was down
+    conn = comfyui.get_connection(server)
+    conn.watch(prompt_id)
+    with metrics.stage(STAGES, "history"):
+        history = await comfyui.get_history(prompt_id, server=server)
+    if prompt_id in history:
+        conn.unwatch(prompt_id)
+    else:
+        # Wait for completion
+        try:
+            success = await comfyui.listen_for_progress(
+                prompt_id, callback=progress_callback, timeout=600, server=server,
+                preview_callback=preview_callback, start_callback=start_callback,
+            )
+        finally:
+            previews.discard(node.id)
+        if started_at is not None:
+            metrics.record(STAGES, "sampling", time.perf_counter() - started_at)
+
+        if not success:
+            fail_node(project_id, node, "Generation timed out or connection lost.")
+            return
+        
+        # Re-fetch history after completion
+        with metrics.stage(STAGES, "history"):
+            history = await comfyui.get_history(prompt_id, server=server)
+    
+    # Get history and save image
+    if prompt_id in history:
+        outputs = history[prompt_id].get("outputs", {})
+        if save_node_id in outputs and ("images" in outputs[save_node_id] or "gifs" in outputs[save_node_id]):
+            # i2v_wan22 saves as video/gif which is actually in 'gifs' or 'images' depending on format
+            media_list = outputs[save_node_id].get("images", outputs[save_node_id].get("gifs", []))
+            if media_list:
+                image_info = media_list[0]
+                filename = image_info["filename"]
+                subfolder = image_info["subfolder"]
+                folder_type = image_info["type"]
+                
+                ext = ".png" if filename.endswith(".png") else ".mp4"
+                # Stream straight into the project folder
+                p_dir = projects.get_project_dir(project_id)
+                image_dest = p_dir / f"{node.id}{ext}"
+                with metrics.stage(STAGES, "download"):
+                    sha256 = await comfyui.download_image(filename, subfolder, folder_type, image_dest, server=server)
+                if sha256:
+                    # Hashed while downloading, so serving it never has to read it all first
+                    await media.record_etag(project_id, image_dest.name, sha256)
+                    if complete_node(project_id, node, image_dest.name) and cache_key:
+                        await results.store(cache_key, image_dest, sha256)
+                else:
+                    fail_node(project_id, node, "Failed to fetch image from ComfyUI.")
+        else:
+            fail_node(project_id, node, "Completed but no image was found in output.")
+    else:
+        fail_node(project_id, node, "Prompt ID not found in history.")
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any
+import database
+
+# Under the projects directory
+JOBS_DB = "jobs.db"
+# Finished and cancelled jobs older than this are pruned on startup
+JOBS_RETENTION_DAYS = int(os.environ.get("COMFYSTUDIO_JOBS_RETENTION_DAYS", "7"))
+
+# Job lifecycle: queued -> running -> done, or cancelling -> cancelled from queued/running.
+# A job only leaves running/cancelling once its node's final status is on disk.
+# A running job with a prompt_id has been accepted by the ComfyUI backend in server.
+ACTIVE_STATUSES = ("queued", "running")
+
+_db: sqlite3.Connection = None
+
+def get_db() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        _db = database.connect(database.path(JOBS_DB))
+        _db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                node_id TEXT UNIQUE NOT NULL,
+                project_id TEXT NOT NULL,
+                batch_id TEXT,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                prompt_id TEXT,
+                server TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        database.add_column(_db, "jobs", "server", "TEXT")
+        _db.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, priority, seq)")
+        _db.execute("CREATE INDEX IF NOT EXISTS jobs_by_batch ON jobs (batch_id)")
+    return _db
+
+def close():
+    global _db
+    if _db is not None:
+        _db.close()
+        _db = None
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+def add(project_id: str, node_ids: List[str], priority: int, batch_id: str = None):
+    now = _now()
+    db = get_db()
+    with db:
+        db.execute("BEGIN")
+        db.executemany(
+            "INSERT INTO jobs (node_id, project_id, batch_id, priority, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            [(node_id, project_id, batch_id, priority, now, now) for node_id in node_ids],
+        )
+
+def get(node_id: str) -> Optional[Dict[str, Any]]:
+    row = get_db().execute("SELECT * FROM jobs WHERE node_id = ?", (node_id,)).fetchone()
+    return dict(row) if row else None
+
+def set_status(node_id: str, status: str, expect_status: str = None) -> bool:
+    """Sets a job's status. With expect_status only a job still in that status is changed."""
+    sql = "UPDATE jobs SET status = ?, updated_at = ? WHERE node_id = ?"
+    args = (status, _now(), node_id)
+    if expect_status is not None:
+        sql += " AND status = ?"
+        args += (expect_status,)
+    return get_db().execute(sql, args).rowcount > 0
+
+def set_prompt_id(node_id: str, prompt_id: Optional[str], server: Optional[str] = None):
+    get_db().execute(
+        "UPDATE jobs SET prompt_id = ?, server = ?, updated_at = ? WHERE node_id = ?", (prompt_id, server, _now(), node_id)
+    )
+
+def requeue(node_id: str):
+    """Puts a running job back in the queue; a job cancelled meanwhile stays cancelled."""
+    get_db().execute(
+        "UPDATE jobs SET status = 'queued', prompt_id = NULL, server = NULL, updated_at = ? "
+        "WHERE node_id = ? AND status = 'running'",
+        (_now(), node_id),
+    )
+
+def set_priority(node_id: str, priority: int) -> bool:
+    cur = get_db().execute(
+        "UPDATE jobs SET priority = ?, updated_at = ? WHERE node_id = ? AND status = 'queued'",
+        (priority, _now(), node_id),
+    )
+    return cur.rowcount > 0
+
+def iter_queued():
+    """Yields queued jobs in dispatch order (priority, then submission order)."""
+    cur = get_db().execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority, seq")
+    for row in cur:
+        yield dict(row)
+
+def list_by_status(status: str) -> List[Dict[str, Any]]:
+    return [dict(r) for r in get_db().execute("SELECT * FROM jobs WHERE status = ? ORDER BY seq", (status,))]
+
+def list_active(project_id: str = None) -> List[Dict[str, Any]]:
+    sql = "SELECT * FROM jobs WHERE status IN ('queued', 'running')"
+    args = ()
+    if project_id:
+        sql += " AND project_id = ?"
+        args = (project_id,)
+    return [dict(r) for r in get_db().execute(sql + " ORDER BY priority, seq", args)]
+
+def list_batch(batch_id: str) -> List[Dict[str, Any]]:
+    return [dict(r) for r in get_db().execute("SELECT * FROM jobs WHERE batch_id = ? ORDER BY seq", (batch_id,))]
+
+def prune():
+    cutoff = (datetime.now() - timedelta(days=JOBS_RETENTION_DAYS)).isoformat()
+    get_db().execute("DELETE FROM jobs WHERE status IN ('done', 'cancelled') AND updated_at < ?", (cutoff,))
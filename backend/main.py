@@ -1,21 +1,65 @@
-import json
 import asyncio
+from contextlib import asynccontextmanager
 from typing import List, Dict, Any
 from typing import List, Dict, Any
-from fastapi import FastAPI, BackgroundTasks, Request
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
 from pydantic import BaseModel
 import websockets
+import uvicorn
 
-from models import Project, GenerationNode, GenerationParams, GenerateRequest, AvailableModels, TemplateList
+from models import Project, ProjectSummary, GenerationNode, GenerationParams, GenerateRequest, AvailableModels, TemplateList, BatchGenerateRequest, BatchStatus, JobInfo, JobPriorityRequest, BackendInfo, ResultCacheStats, NodePage, SearchResults, StorageReport
 import projects
 import comfyui
 import templates
 import workflows
+import events
+import scheduler
+import catalog
+import media
+import previews
+import results
+import search
+import storage
+import metrics
 
-app = FastAPI(title="ComfyStudio API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    projects.init_projects_dir()
+    events.open_streams()
+    flusher = asyncio.create_task(projects.run_flusher())
+    comfyui.start_connections()
+    health = asyncio.create_task(comfyui.run_health_checks())
+    await scheduler.start()
+    indexer = asyncio.create_task(search.run_indexer())
+    storage_manager = asyncio.create_task(storage.run_storage_manager())
+    yield
+    # Usually done already by Server.shutdown; other servers may wait on open streams too
+    events.close_streams()
+    # Before the scheduler stops, or a pass waiting for running jobs would resume
+    storage_manager.cancel()
+    await scheduler.stop()
+    health.cancel()
+    for task in (indexer, storage_manager):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    search.close()
+    media.shutdown()
+    results.close()
+    await comfyui.close_connections()
+    await comfyui.close_http_client()
+    flusher.cancel()
+    try:
+        await flusher
+    except asyncio.CancelledError:
+        pass
+
+app = FastAPI(title="ComfyStudio API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,18 +69,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if metrics.SERVER_TIMING:
+    app.add_middleware(metrics.ServerTimingMiddleware)
+
+@app.get("/metrics")
+async def get_metrics():
+    from fastapi.responses import PlainTextResponse
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/health")
 async def health_check():
     return {"status": "ok"}
 
 @app.get("/api/models", response_model=AvailableModels)
-async def get_models():
-    models = comfyui.get_available_models()
-    return AvailableModels(
-        checkpoints=models.get("checkpoints", []), 
-        unets=models.get("unets", []),
-        loras=models.get("loras", [])
-    )
+async def get_models(request: Request):
+    from fastapi.responses import JSONResponse, Response
+    models, etag = await catalog.get_catalog()
+    headers = {"Cache-Control": "no-cache"}
+    if etag:
+        headers["ETag"] = etag
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+    return JSONResponse(models.model_dump(), headers=headers)
+
+@app.post("/api/models/refresh", response_model=AvailableModels)
+async def refresh_models():
+    return await catalog.refresh()
 
 @app.get("/api/templates", response_model=TemplateList)
 async def list_templates():
@@ -59,9 +117,9 @@ async def update_workflow(name: str, req: Request):
     workflows.save_workflow(name, config)
     return {"status": "ok"}
 
-@app.get("/api/projects", response_model=List[Project])
+@app.get("/api/projects", response_model=List[ProjectSummary])
 async def list_projects():
-    return projects.get_all_projects()
+    return projects.get_project_summaries()
 
 @app.post("/api/projects", response_model=Project)
 async def create_project(req: Dict[str, str]):
@@ -75,139 +133,46 @@ async def get_project(project_id: str):
         return {"error": "Project not found"}
     return p
 
-async def run_generation(project_id: str, node: GenerationNode):
-    wf_name = node.params.workflow
-    registry = workflows.get_workflows()
-    
-    if wf_name not in registry:
-        print(f"Workflow {wf_name} not found in registry")
-        return
-        
-    wf_info = registry[wf_name]
-    workflow = json.loads(json.dumps(wf_info["data"])) # deep copy
-    m = wf_info["map"]
-    
-    # Inject params
-    if m.get("sampler") in workflow:
-        workflow[m["sampler"]]["inputs"]["seed"] = node.params.seed
-        workflow[m["sampler"]]["inputs"]["steps"] = node.params.steps
-        workflow[m["sampler"]]["inputs"]["cfg"] = node.params.cfg
-    
-    if m.get("positive_prompt") in workflow:
-        workflow[m["positive_prompt"]]["inputs"]["text"] = node.params.prompt
-        
-    if m.get("negative_prompt") in workflow:
-        workflow[m["negative_prompt"]]["inputs"]["text"] = node.params.negative_prompt
-        
-    if m.get("model") in workflow and node.params.model:
-        workflow[m["model"]]["inputs"][m["model_field"]] = node.params.model
-        
-    if m.get("lora") in workflow:
-        lora_node_id = m["lora"]
-        lora_node = workflow.get(lora_node_id)
-        
-        if lora_node:
-            if node.params.bypass_lora or not node.params.lora:
-                # Bypass: Find upstream model and clip connected to this LoraLoader
-                upstream_model = lora_node["inputs"].get("model")
-                upstream_clip = lora_node["inputs"].get("clip")
-                
-                # Re-route all downstream nodes that point to this LoraLoader
-                for n_id, n_data in workflow.items():
-                    if n_id == lora_node_id: continue
-                    inputs = n_data.get("inputs", {})
-                    for k, v in inputs.items():
-                        if isinstance(v, list) and len(v) == 2 and v[0] == lora_node_id:
-                            # Re-route based on the expected output type (0 for model, 1 for clip)
-                            output_idx = v[1]
-                            if output_idx == 0 and upstream_model:
-                                inputs[k] = upstream_model
-                            elif output_idx == 1 and upstream_clip:
-                                inputs[k] = upstream_clip
-                                
-                # Remove the LoraLoader node from the workflow
-                del workflow[lora_node_id]
-            else:
-                # Enable LoRA
-                if "lora_field" in m:
-                    lora_node["inputs"][m["lora_field"]] = node.params.lora
-                # Ensure it remains connected as defined in the template
-            
-    if m.get("latent") in workflow:
-        workflow[m["latent"]]["inputs"]["width"] = node.params.width
-        workflow[m["latent"]]["inputs"]["height"] = node.params.height
-    
-    # Queue prompt
-    prompt_id = comfyui.queue_prompt(workflow)
-    if not prompt_id:
-        node.status = "error"
-        node.error = "Failed to queue prompt to ComfyUI."
-        projects.add_node_to_project(project_id, node)
-        return
-        
-    async def progress_callback(data):
-        val = data.get('value', 0)
-        m = data.get('max', 1)
-        node.progress = val / m if m > 0 else 0
-        projects.add_node_to_project(project_id, node)
-
-    # Check if already completed (cached) before waiting on websocket
-    history = comfyui.get_history(prompt_id)
-    if prompt_id not in history:
-        # Wait for completion
-        success = await comfyui.listen_for_progress(prompt_id, callback=progress_callback, timeout=600)
-        
-        if not success:
-            node.status = "error"
-            node.error = "Generation timed out or connection lost."
-            projects.add_node_to_project(project_id, node)
-            return
-        
-        # Re-fetch history after completion
-        history = comfyui.get_history(prompt_id)
-    
-    # Get history and save image
-    if prompt_id in history:
-        save_node_id = m.get("save")
-        outputs = history[prompt_id].get("outputs", {})
-        if save_node_id in outputs and ("images" in outputs[save_node_id] or "gifs" in outputs[save_node_id]):
-            # i2v_wan22 saves as video/gif which is actually in 'gifs' or 'images' depending on format
-            media_list = outputs[save_node_id].get("images", outputs[save_node_id].get("gifs", []))
-            if media_list:
-                image_info = media_list[0]
-                filename = image_info["filename"]
-                subfolder = image_info["subfolder"]
-                folder_type = image_info["type"]
-                
-                image_bytes = comfyui.get_image(filename, subfolder, folder_type)
-                if image_bytes:
-                    ext = ".png" if filename.endswith(".png") else ".mp4"
-                    # Save to project folder
-                    p_dir = projects.get_project_dir(project_id)
-                    image_dest = p_dir / f"{node.id}{ext}"
-                    with open(image_dest, "wb") as f:
-                        f.write(image_bytes)
-                    
-                    # Update node
-                    node.image_filename = f"{node.id}{ext}"
-                    node.status = "completed"
-                    node.progress = 1.0
-                    projects.add_node_to_project(project_id, node)
-                else:
-                    node.status = "error"
-                    node.error = "Failed to fetch image from ComfyUI."
-                    projects.add_node_to_project(project_id, node)
-        else:
-            node.status = "error"
-            node.error = "Completed but no image was found in output."
-            projects.add_node_to_project(project_id, node)
-    else:
-        node.status = "error"
-        node.error = "Prompt ID not found in history."
-        projects.add_node_to_project(project_id, node)
+@app.get("/api/projects/{project_id}/nodes", response_model=NodePage)
+async def list_project_nodes(project_id: str, limit: int = 100, cursor: str = None, since: int = None, parent_id: str = None):
+    limit = max(1, min(limit, projects.MAX_PAGE_SIZE))
+    try:
+        page = projects.get_nodes_page(project_id, limit=limit, cursor=cursor, since=since, parent_id=parent_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return page
+
+@app.get("/api/search", response_model=SearchResults)
+async def search_nodes(q: str = None, project_id: str = None, workflow: str = None, model: str = None,
+                       lora: str = None, seed: int = None, status: str = None, limit: int = 50, offset: int = 0):
+    """Searches the params of every node across projects; q matches prompts, models, LoRAs, template values and workflows."""
+    return await search.search(
+        q, limit=limit, offset=offset, project_id=project_id, workflow=workflow,
+        model=model, lora=lora, seed=seed, status=status,
+    )
+
+@app.get("/api/projects/{project_id}/events")
+async def project_events(project_id: str):
+    from fastapi.responses import StreamingResponse
+    return StreamingResponse(
+        events.stream(project_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/projects/{project_id}/nodes/{node_id}/preview")
+async def get_node_preview(project_id: str, node_id: str):
+    from fastapi.responses import Response
+    preview = previews.get(project_id, node_id)
+    if preview is None:
+        raise HTTPException(status_code=404, detail="No preview available")
+    mime, data = preview
+    return Response(content=data, media_type=mime, headers={"Cache-Control": "no-store"})
 
 @app.post("/api/generate", response_model=GenerationNode)
-async def generate(req: GenerateRequest, background_tasks: BackgroundTasks):
+async def generate(req: GenerateRequest):
     node = GenerationNode(
         parent_id=req.parent_node_id,
         params=req.params,
@@ -216,26 +181,124 @@ async def generate(req: GenerateRequest, background_tasks: BackgroundTasks):
     )
     # Add optimistic node
     projects.add_node_to_project(req.project_id, node)
+    events.publish_node(req.project_id, "queued", node)
     
     # Run generation in background
-    background_tasks.add_task(run_generation, req.project_id, node)
+    scheduler.submit(req.project_id, node)
     
     return node
 
+@app.post("/api/generate/batch", response_model=BatchStatus)
+async def generate_batch(req: BatchGenerateRequest):
+    if not projects.load_project(req.project_id):
+        raise HTTPException(status_code=404, detail="Project not found")
+    size = scheduler.batch_size(req)
+    if size < 1 or size > scheduler.MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch must contain between 1 and {scheduler.MAX_BATCH_SIZE} generations, got {size}")
+
+    nodes = [
+        GenerationNode(parent_id=req.parent_node_id, params=params, status="generating", progress=0.0)
+        for params in scheduler.expand_batch(req)
+    ]
+    # One store call for the whole batch, persisted by a single flush
+    projects.add_nodes_to_project(req.project_id, nodes)
+    for node in nodes:
+        events.publish_node(req.project_id, "queued", node)
+
+    batch_id = scheduler.submit_batch(req.project_id, nodes)
+    return scheduler.get_batch_status(batch_id)
+
+@app.get("/api/batches/{batch_id}", response_model=BatchStatus)
+async def get_batch(batch_id: str):
+    status = scheduler.get_batch_status(batch_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return status
+
+@app.get("/api/jobs", response_model=List[JobInfo])
+async def list_jobs(project_id: str = None):
+    return scheduler.list_jobs(project_id)
+
+@app.post("/api/jobs/{node_id}/cancel")
+async def cancel_job(node_id: str):
+    if not await scheduler.cancel(node_id):
+        raise HTTPException(status_code=404, detail="No queued or running job for this node")
+    return {"status": "ok"}
+
+@app.post("/api/jobs/{node_id}/priority")
+async def set_job_priority(node_id: str, req: JobPriorityRequest):
+    if not scheduler.set_priority(node_id, req.priority):
+        raise HTTPException(status_code=404, detail="No queued job for this node")
+    return {"status": "ok"}
+
+@app.get("/api/backends", response_model=List[BackendInfo])
+async def list_backends():
+    return [b.to_dict() for b in comfyui.get_backends()]
+
+@app.get("/api/result-cache", response_model=ResultCacheStats)
+async def result_cache_stats():
+    return results.stats()
+
+@app.get("/api/storage", response_model=StorageReport)
+async def storage_report():
+    """Disk usage per project and the files no node references."""
+    return await storage.report()
+
+@app.post("/api/storage/run")
+async def run_storage_pass():
+    """Runs the storage policies now instead of at the next interval."""
+    storage.trigger()
+    return {"status": "started"}
+
+@app.post("/api/interrupt")
+async def interrupt(server: str = None):
+    """Stops whatever ComfyUI is executing right now, on one backend or all of them."""
+    if not await comfyui.interrupt(server):
+        raise HTTPException(status_code=502, detail="Could not reach ComfyUI")
+    return {"status": "ok"}
+
 @app.get("/api/projects/{project_id}/images/{filename}")
-async def get_project_image(project_id: str, filename: str):
-    from fastapi.responses import FileResponse
+async def get_project_image(project_id: str, filename: str, request: Request, size: str = None):
     p_dir = projects.get_project_dir(project_id)
-    image_path = p_dir / filename
-    if image_path.exists():
-        return FileResponse(image_path)
+    # Path parameters are decoded, so "%2E%2E" could otherwise step out of Projects/
+    if not (p_dir / filename).resolve().is_relative_to(projects.PROJECTS_DIR.resolve()):
+        raise HTTPException(status_code=404, detail="Image not found")
+    # Old outputs may have been moved to cold storage
+    image_path = storage.locate(project_id, filename)
+    if image_path is not None:
+        if size:
+            derived = await media.get_derivative(project_id, filename, size)
+            if derived:
+                return await media.serve_file(request, derived)
+        etag_file = media.etag_file(project_id, filename)
+        try:
+            return await media.serve_file(request, image_path, etag_file)
+        except FileNotFoundError:
+            # Moved to cold storage between locating and opening it
+            image_path = storage.locate(project_id, filename)
+            if image_path is not None:
+                return await media.serve_file(request, image_path, etag_file)
     return {"error": "Image not found"}
 
 # Mount the frontend directory to serve static files
 frontend_dir = Path(__file__).parent.parent / "frontend"
 app.mount("/", StaticFiles(directory=str(frontend_dir), html=True), name="frontend")
 
+# Seconds uvicorn waits for open requests before cancelling them and running
+# the lifespan shutdown (final project flush, scheduler stop)
+SHUTDOWN_TIMEOUT = 5
+
+class Server(uvicorn.Server):
+    """uvicorn server that ends event streams as soon as it starts shutting down.
+
+    uvicorn waits for every connection to close before the lifespan shutdown,
+    and an event stream only closes when the browser tab does.
+    """
+    async def shutdown(self, sockets=None):
+        events.close_streams()
+        await super().shutdown(sockets=sockets)
+
 if __name__ == "__main__":
-    import uvicorn
     projects.init_projects_dir()
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    config = uvicorn.Config(app, host="127.0.0.1", port=8000, timeout_graceful_shutdown=SHUTDOWN_TIMEOUT)
+    Server(config).run()
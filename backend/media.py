@@ -0,0 +1,230 @@
+import os
+import shutil
+import asyncio
+import hashlib
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+import projects
+import storage
+import metrics
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+FFMPEG = shutil.which("ffmpeg")
+
+# Longest edge in pixels of each derivative size served via ?size=
+SIZES = {"thumb": 256, "preview": 1024}
+DERIVED_DIR = ".derived"
+WEBP_QUALITY = 80
+THUMBNAIL_WORKERS = int(os.environ.get("COMFYSTUDIO_THUMBNAIL_WORKERS", "2"))
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".gif")
+
+# Outputs are written once under a unique name, so browsers may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# How many content hashes to remember in memory; every output's is also kept on
+# disk as DERIVED_DIR/<filename>.etag, valid while the file's size and mtime match
+ETAG_CACHE_SIZE = 4096
+ETAG_SUFFIX = ".etag"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_pool: Optional[ProcessPoolExecutor] = None
+# Derivative path -> future, so concurrent requests share one render
+_pending: Dict[Path, asyncio.Future] = {}
+# Strong references to fire-and-forget render tasks
+_background = set()
+# (path, mtime_ns, size) -> quoted sha256 ETag
+_etags: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+
+class MediaFileResponse(FileResponse):
+    # Fewer, larger reads when the server can't use http.response.pathsend
+    chunk_size = 1024 * 1024
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _pool
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def is_video(filename: str) -> bool:
+    return filename.lower().endswith(VIDEO_EXTENSIONS)
+
+def derivative_path(project_id: str, filename: str, size: str) -> Path:
+    # Videos get a JPEG poster frame, images a WebP
+    ext = ".jpg" if is_video(filename) else ".webp"
+    return projects.get_project_dir(project_id) / DERIVED_DIR / f"{Path(filename).stem}.{size}{ext}"
+
+def can_render(filename: str) -> bool:
+    return FFMPEG is not None if is_video(filename) else Image is not None
+
+def _render(src: str, dest: str, max_dim: int):
+    """Runs in a worker process: writes a downscaled copy of src to dest atomically."""
+    tmp = dest + ".tmp" + os.path.splitext(dest)[1]
+    if src.lower().endswith(VIDEO_EXTENSIONS):
+        subprocess.run(
+            [FFMPEG, "-v", "error", "-y", "-i", src, "-frames:v", "1",
+             "-vf", f"scale='min({max_dim},iw)':'min({max_dim},ih)':force_original_aspect_ratio=decrease",
+             "-q:v", "4", tmp],
+            check=True, stdin=subprocess.DEVNULL,
+        )
+    else:
+        with Image.open(src) as im:
+            im.thumbnail((max_dim, max_dim))
+            if im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+            im.save(tmp, "WEBP", quality=WEBP_QUALITY, method=4)
+    os.replace(tmp, dest)
+
+async def get_derivative(project_id: str, filename: str, size: str) -> Optional[Path]:
+    """Returns the cached derivative of a project file, rendering it on first use.
+
+    Returns None when the derivative can't be produced (unknown size, missing
+    source, or Pillow/ffmpeg not installed); callers fall back to the original.
+    """
+    if size not in SIZES or not can_render(filename):
+        return None
+    dest = derivative_path(project_id, filename, size)
+    if dest.exists():
+        return dest
+    src = storage.locate(project_id, filename)
+    if src is None:
+        return None
+
+    fut = _pending.get(dest)
+    if fut is None:
+        os.makedirs(dest.parent, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(get_pool(), _render, str(src), str(dest), SIZES[size])
+        _pending[dest] = fut
+        fut.add_done_callback(lambda _: _pending.pop(dest, None))
+    try:
+        with metrics.stage(metrics.STORAGE_SECONDS, "derivative"):
+            await asyncio.shield(fut)
+    except Exception as e:
+        print(f"Error rendering {size} of {filename}: {e}")
+        return None
+    return dest
+
+async def generate_derivatives(project_id: str, filename: str):
+    """Renders every derivative size of a freshly completed output."""
+    for size in SIZES:
+        await get_derivative(project_id, filename, size)
+
+def schedule_derivatives(project_id: str, filename: str):
+    """Starts rendering derivatives in the background without waiting for them."""
+    if not can_render(filename):
+        return
+    task = asyncio.create_task(generate_derivatives(project_id, filename))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+def etag_file(project_id: str, filename: str) -> Path:
+    """Where the content hash of a project output is kept, wherever the output itself lives."""
+    return projects.get_project_dir(project_id) / DERIVED_DIR / (filename + ETAG_SUFFIX)
+
+def _etag(hexdigest: str) -> str:
+    return '"%s"' % hexdigest[:32]
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _save_etag(sidecar: Path, st: os.stat_result, etag: str):
+    os.makedirs(sidecar.parent, exist_ok=True)
+    tmp = sidecar.with_name(sidecar.name + ".tmp")
+    with open(tmp, "w") as f:
+        f.write(f"{st.st_size} {st.st_mtime_ns} {etag}\n")
+    os.replace(tmp, sidecar)
+
+def _load_etag(sidecar: Path, st: os.stat_result) -> Optional[str]:
+    try:
+        with open(sidecar) as f:
+            size, mtime_ns, etag = f.read().split()
+    except (OSError, ValueError):
+        return None
+    # Recompression or a rewrite changes the file; its old hash no longer applies
+    return etag if (int(size), int(mtime_ns)) == (st.st_size, st.st_mtime_ns) else None
+
+def _resolve_etag(path: str, st: os.stat_result, sidecar: Optional[Path]) -> str:
+    etag = _load_etag(sidecar, st) if sidecar else None
+    if etag is None:
+        etag = _etag(_hash_file(path))
+        if sidecar:
+            try:
+                _save_etag(sidecar, st, etag)
+            except OSError as e:
+                print(f"Could not save content hash of {path}: {e}")
+    return etag
+
+def _remember(key: Tuple[str, int, int], etag: str):
+    _etags[key] = etag
+    while len(_etags) > ETAG_CACHE_SIZE:
+        _etags.popitem(last=False)
+
+async def record_etag(project_id: str, filename: str, hexdigest: str):
+    """Stores the SHA-256 of a freshly written output, so serving it never has to hash it."""
+    path = projects.get_project_dir(project_id) / filename
+    etag = _etag(hexdigest)
+
+    def save():
+        st = os.stat(path)
+        _save_etag(etag_file(project_id, filename), st, etag)
+        return st
+
+    try:
+        st = await asyncio.to_thread(save)
+    except OSError as e:
+        print(f"Could not save content hash of {filename}: {e}")
+        return
+    _remember((str(path), st.st_mtime_ns, st.st_size), etag)
+
+async def content_etag(path: Path, st: os.stat_result, sidecar: Path = None) -> str:
+    """Strong ETag from the file contents.
+
+    Looked up in memory, then in sidecar (see etag_file) when given; only a
+    file with neither is hashed, in a thread, and the result saved to sidecar.
+    """
+    key = (str(path), st.st_mtime_ns, st.st_size)
+    etag = _etags.get(key)
+    if etag is None:
+        etag = await asyncio.to_thread(_resolve_etag, str(path), st, sidecar)
+        _remember(key, etag)
+    else:
+        _etags.move_to_end(key)
+    return etag
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return etag in tags or ("W/" + etag) in tags
+
+async def serve_file(request: Request, path: Path, etag_sidecar: Path = None) -> Response:
+    """Serves an immutable media file with a content-hash ETag, 304 revalidation and byte ranges.
+
+    Range handling and zero-copy http.response.pathsend (when the ASGI server
+    supports it) come from FileResponse.
+    """
+    st = await asyncio.to_thread(os.stat, path)
+    etag = await content_etag(path, st, etag_sidecar)
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return MediaFileResponse(path, headers=headers, stat_result=st)
@@ -0,0 +1,171 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Optional
+
+# Adds a Server-Timing header with the request's total and per-stage durations
+SERVER_TIMING = os.environ.get("COMFYSTUDIO_SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+
+# Upper bounds (seconds) shared by every histogram
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+REGISTRY: List["_Metric"] = []
+
+# (stage, seconds) recorded by stage() while a request is being served
+_request_timings: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_timings", default=None)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = ['%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"')) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+def _format_value(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+class _Metric:
+    """Name, help text and labels shared by every metric; subclasses provide samples()."""
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """Monotonically increasing total."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            row = self.values.get(key)
+            if row is None:
+                row = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            else:
+                row[len(self.buckets)] += 1
+            row[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self.values.items()]
+        out = []
+        for key, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row):
+                cumulative += count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else _format_value(bound))
+                out.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            out.append(f"{self.name}_sum{labels} {_format_value(row[-1])}")
+            out.append(f"{self.name}_count{labels} {cumulative}")
+        return out
+
+@contextmanager
+def stage(histogram: Histogram, name: str):
+    """Times a block into histogram under stage=name, and into the request's Server-Timing."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(histogram, name, time.perf_counter() - started)
+
+def record(histogram: Histogram, name: str, seconds: float):
+    histogram.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+def render() -> str:
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+class ServerTimingMiddleware:
+    """ASGI middleware adding a Server-Timing header (total plus recorded stages) to HTTP responses."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        timings = []
+        token = _request_timings.set(timings)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                parts = ["total;dur=%.1f" % ((time.perf_counter() - started) * 1000)]
+                parts += ["%s;dur=%.1f" % (name, seconds * 1000) for name, seconds in timings]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", ", ".join(parts).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+
+GENERATION_STAGE_SECONDS = Histogram(
+    "comfystudio_generation_stage_seconds", "Time spent in each stage of a generation.", ("stage",)
+)
+GENERATIONS = Counter("comfystudio_generations_total", "Generations finished, by result.", ("result",))
+PROMPTS_IN_FLIGHT = Gauge("comfystudio_prompts_in_flight", "Prompts accepted by ComfyUI and not finished yet.")
+PROMPTS_IN_FLIGHT.set(0)
+STORAGE_SECONDS = Histogram("comfystudio_storage_seconds", "Time spent loading projects and preparing media.", ("stage",))
+PROJECT_SAVES = Counter("comfystudio_project_saves_total", "Project files written, by kind.", ("kind",))
+PROJECT_BYTES_WRITTEN = Counter("comfystudio_project_bytes_written_total", "Bytes written to project files, by kind.", ("kind",))
+DOWNLOAD_BYTES = Counter("comfystudio_download_bytes_total", "Output bytes downloaded from ComfyUI.")
+STORAGE_ACTIONS = Counter("comfystudio_storage_actions_total", "Files recompressed, moved to cold storage or deleted as orphans.", ("action",))
+STORAGE_BYTES_RECLAIMED = Counter("comfystudio_storage_bytes_reclaimed_total", "Bytes freed in the projects folder, by storage action.", ("action",))
@@ -24,6 +24,8 @@ class AvailableModels(BaseModel):
     checkpoints: List[str] = []
     unets: List[str] = []
     loras: List[str] = []
+    # Choices of every loader input referenced by a workflow, keyed "ClassType.field"
+    loaders: Dict[str, List[str]] = {}
 
 class TemplateList(BaseModel):
     characters: List[str] = ["1girl", "1boy"]
@@ -55,15 +57,157 @@ class GenerationNode(BaseModel):
     status: str = "completed"  # generating, completed, error
     progress: float = 1.0
     error: Optional[str] = None
+    # Project revision at which this node last changed
+    revision: int = 0
 
 class Project(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str = "New Project"
     created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
     updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    # Bumped on every persisted node change
+    revision: int = 0
     nodes: Dict[str, GenerationNode] = {}
+
+class ProjectSummary(BaseModel):
+    id: str
+    name: str
+    created_at: str
+    updated_at: str
+    node_count: int = 0
+    thumbnail_node_id: Optional[str] = None
+    thumbnail: Optional[str] = None  # image_filename of the latest finished node
+    revision: int = 0
     
+class NodePage(BaseModel):
+    nodes: List[GenerationNode]
+    # Pass as cursor= to get the next page, None on the last page
+    next_cursor: Optional[str] = None
+    # Pass as since= to get nodes changed after this page
+    revision: int
+    has_more: bool = False
+
+class SearchHit(BaseModel):
+    project_id: str
+    node_id: str
+    timestamp: str
+    status: str
+    image_filename: Optional[str] = None
+    params: GenerationParams
+    # Prompt excerpt with matched terms in [brackets]; None without a text query
+    snippet: Optional[str] = None
+    # Higher is more relevant; None without a text query
+    score: Optional[float] = None
+
+class SearchResults(BaseModel):
+    total: int
+    # False when there are more matches than were counted; total is then a lower bound
+    total_exact: bool = True
+    results: List[SearchHit]
+
 class GenerateRequest(BaseModel):
     project_id: str
     parent_node_id: Optional[str] = None
     params: GenerationParams
+
+class SeedRange(BaseModel):
+    start: int
+    count: int = 1
+    step: int = 1
+
+class BatchGenerateRequest(BaseModel):
+    project_id: str
+    parent_node_id: Optional[str] = None
+    params: GenerationParams  # base params, each axis below overrides one field
+    seeds: Optional[List[int]] = None
+    seed_range: Optional[SeedRange] = None
+    cfgs: Optional[List[float]] = None
+    steps: Optional[List[int]] = None
+    # e.g. {"character": ["1girl", "1boy"], "style": [...]}, rendered into params.prompt_template
+    template_values: Optional[Dict[str, List[str]]] = None
+
+class BatchStatus(BaseModel):
+    id: str
+    project_id: str
+    created_at: str
+    node_ids: List[str] = []
+    total: int = 0
+    generating: int = 0
+    completed: int = 0
+    error: int = 0
+    progress: float = 0.0
+
+class JobInfo(BaseModel):
+    node_id: str
+    project_id: str
+    batch_id: Optional[str] = None
+    priority: int
+    status: str  # queued, running, done, cancelling, cancelled
+    prompt_id: Optional[str] = None
+    server: Optional[str] = None
+    created_at: str
+    updated_at: str
+
+class JobPriorityRequest(BaseModel):
+    priority: int
+
+class ResultCacheStats(BaseModel):
+    enabled: bool
+    entries: int
+    bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+    stores: int
+    evictions: int
+    hit_ratio: float
+
+class ProjectStorage(BaseModel):
+    id: str
+    name: str
+    # Referenced outputs in the project folder
+    media_bytes: int = 0
+    media_files: int = 0
+    # Referenced outputs moved to cold storage
+    cold_bytes: int = 0
+    cold_files: int = 0
+    derived_bytes: int = 0  # thumbnails and previews
+    project_file_bytes: int = 0  # snapshot and journal
+    orphan_bytes: int = 0
+    orphan_files: int = 0
+    total_bytes: int = 0
+
+class OrphanFile(BaseModel):
+    project_id: str
+    # Relative to Projects/, or to the cold storage directory when cold
+    path: str
+    bytes: int
+    cold: bool = False
+
+class StorageRun(BaseModel):
+    started_at: str
+    finished_at: Optional[str] = None
+    recompressed: int = 0
+    bytes_saved: int = 0
+    moved_cold: int = 0
+    bytes_moved: int = 0
+    orphans_deleted: int = 0
+    bytes_deleted: int = 0
+    # Time spent waiting for generations to finish
+    paused_seconds: float = 0.0
+
+class StorageReport(BaseModel):
+    projects: List[ProjectStorage]
+    total_bytes: int
+    # At most 1000 are listed; the counts cover all of them
+    orphans: List[OrphanFile]
+    orphan_files: int
+    orphan_bytes: int
+    cold_storage_dir: Optional[str] = None
+    last_run: Optional[StorageRun] = None
+
+class BackendInfo(BaseModel):
+    server: str
+    healthy: bool
+    queue_depth: int
+    last_model: Optional[str] = None
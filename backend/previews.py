@@ -0,0 +1,72 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Optional, Tuple
+import events
+
+# Most nodes whose latest preview frame is kept in memory; older ones are evicted
+PREVIEW_BUFFER_NODES = int(os.environ.get("COMFYSTUDIO_PREVIEW_BUFFER_NODES", "32"))
+# Highest rate at which "preview" events are pushed for one node (frames per second)
+PREVIEW_FPS = float(os.environ.get("COMFYSTUDIO_PREVIEW_FPS", "4"))
+
+class Preview:
+    """Latest sampler preview of a node. Only the newest frame is kept."""
+    __slots__ = ("project_id", "mime", "data", "rev", "published_at", "timer")
+
+    def __init__(self, project_id: str):
+        self.project_id = project_id
+        self.mime = None
+        self.data = b""
+        self.rev = 0
+        self.published_at = 0.0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+PREVIEWS: "OrderedDict[str, Preview]" = OrderedDict()
+
+def _publish(node_id: str, p: Preview):
+    p.timer = None
+    p.published_at = time.monotonic()
+    events.publish(p.project_id, "preview", node_id, rev=p.rev)
+
+def put(project_id: str, node_id: str, mime: str, data: bytes):
+    """Stores a preview frame and announces it, at most PREVIEW_FPS times a second.
+
+    Frames arriving faster replace each other; a trailing event makes sure the
+    newest one is always announced.
+    """
+    p = PREVIEWS.get(node_id)
+    if p is None:
+        p = PREVIEWS[node_id] = Preview(project_id)
+        while len(PREVIEWS) > PREVIEW_BUFFER_NODES:
+            _, old = PREVIEWS.popitem(last=False)
+            old.cancel()
+    else:
+        PREVIEWS.move_to_end(node_id)
+    p.mime = mime
+    p.data = data
+    p.rev += 1
+    if p.timer is not None:
+        return
+    wait = p.published_at + 1.0 / PREVIEW_FPS - time.monotonic() if PREVIEW_FPS > 0 else 0
+    if wait <= 0:
+        _publish(node_id, p)
+    else:
+        p.timer = asyncio.get_running_loop().call_later(wait, _publish, node_id, p)
+
+def get(project_id: str, node_id: str) -> Optional[Tuple[str, bytes]]:
+    """Returns (mime type, image bytes) of the latest preview of a node, if any."""
+    p = PREVIEWS.get(node_id)
+    if p is None or p.project_id != project_id:
+        return None
+    return p.mime, p.data
+
+def discard(node_id: str):
+    p = PREVIEWS.pop(node_id, None)
+    if p is not None:
+        p.cancel()
@@ -1,40 +1,367 @@
 import json
 import os
+import base64
+import asyncio
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
 from pathlib import Path
-from models import Project, GenerationNode, GenerationParams
+from typing import Dict, Set, List, Optional, Tuple
+from models import Project, GenerationNode, GenerationParams, ProjectSummary, NodePage
+import metrics
+import search
 
 PROJECTS_DIR = Path(__file__).parent.parent / "Projects"
 
+# Seconds between write-behind flushes of dirty projects
+FLUSH_INTERVAL = float(os.environ.get("COMFYSTUDIO_FLUSH_INTERVAL", "2.0"))
+# Journal size in bytes after which the project is compacted into a new snapshot
+JOURNAL_COMPACT_BYTES = int(os.environ.get("COMFYSTUDIO_JOURNAL_COMPACT_BYTES", str(4 * 1024 * 1024)))
+
+# On-disk layout under Projects/<id>/:
+#   snapshot.json  - {"seq": N, "project": {...}} compact full snapshot
+#   journal.jsonl  - one upsert record per line, replayed on top of the snapshot
+#   project.json   - legacy monolithic file, migrated to a snapshot on first load
+SNAPSHOT_FILE = "snapshot.json"
+JOURNAL_FILE = "journal.jsonl"
+LEGACY_FILE = "project.json"
+# Summary index of all projects, kept at Projects/index.json
+INDEX_FILE = "index.json"
+
+# Resident project store: every loaded project lives here, and mutations
+# only mark it dirty. The flusher coalesces them into journal appends.
+PROJECT_CACHE: Dict[str, Project] = {}
+DIRTY_PROJECTS: Set[str] = set()
+# Per project: ids of nodes changed since the last flush
+DIRTY_NODES: Dict[str, Set[str]] = {}
+# Per project: sequence number of the last journal record
+JOURNAL_SEQ: Dict[str, int] = {}
+COMPACTING: Set[str] = set()
+# In-memory mutations never await, so the event loop already serializes them.
+# These per-project locks serialize the disk writers (flush, compaction) so no
+# two of them touch a project's files at once.
+PROJECT_LOCKS: Dict[str, asyncio.Lock] = {}
+
+# Largest page /api/projects/{id}/nodes returns
+MAX_PAGE_SIZE = 1000
+
+# project id -> summary dict plus "mtime_ns" of the project files it was built from
+PROJECT_INDEX: Dict[str, dict] = {}
+_index_loaded = False
+_index_dirty = False
+
+class NodeIndex:
+    """Orderings of one cached project's nodes for paginated and incremental reads.
+
+    by_time holds (timestamp, id) keys sorted for cursor pagination, by_revision
+    the node ids in the order they last changed, children the ids under each parent.
+    Kept up to date by add_node_to_project/add_nodes_to_project once built.
+    """
+    def __init__(self, p: Project):
+        self.project = p
+        nodes = sorted(p.nodes.values(), key=lambda n: n.revision)
+        self.keys: Dict[str, Tuple[str, str]] = {n.id: (n.timestamp, n.id) for n in nodes}
+        self.by_time: List[Tuple[str, str]] = sorted(self.keys.values())
+        self.by_revision: "OrderedDict[str, int]" = OrderedDict((n.id, n.revision) for n in nodes)
+        self.parents: Dict[str, Optional[str]] = {}
+        self.children: Dict[Optional[str], List[str]] = {}
+        for n in nodes:
+            self.parents[n.id] = n.parent_id
+            self.children.setdefault(n.parent_id, []).append(n.id)
+
+    def update(self, node: GenerationNode):
+        key = (node.timestamp, node.id)
+        old = self.keys.get(node.id)
+        if old != key:
+            if old is not None:
+                del self.by_time[bisect_left(self.by_time, old)]
+            insort(self.by_time, key)
+            self.keys[node.id] = key
+        if node.id not in self.parents or self.parents[node.id] != node.parent_id:
+            if node.id in self.parents:
+                self.children[self.parents[node.id]].remove(node.id)
+            self.parents[node.id] = node.parent_id
+            self.children.setdefault(node.parent_id, []).append(node.id)
+        # Transient updates keep their revision and their place
+        if self.by_revision.get(node.id) != node.revision:
+            self.by_revision[node.id] = node.revision
+            self.by_revision.move_to_end(node.id)
+
+    def descendants(self, node_id: str) -> Set[str]:
+        out = set()
+        stack = list(self.children.get(node_id, ()))
+        while stack:
+            child = stack.pop()
+            if child not in out:
+                out.add(child)
+                stack.extend(self.children.get(child, ()))
+        return out
+
+NODE_INDEXES: Dict[str, NodeIndex] = {}
+
 def init_projects_dir():
     os.makedirs(PROJECTS_DIR, exist_ok=True)
 
 def get_project_dir(project_id: str) -> Path:
     return PROJECTS_DIR / project_id
 
-def save_project(project: Project):
-    p_dir = get_project_dir(project.id)
+def project_lock(project_id: str) -> asyncio.Lock:
+    """Lock held while a project's files are written; take it for any read-modify-write that awaits."""
+    lock = PROJECT_LOCKS.get(project_id)
+    if lock is None:
+        lock = PROJECT_LOCKS[project_id] = asyncio.Lock()
+    return lock
+
+def _write_atomic(path: Path, data: str) -> int:
+    """Writes to a temp file next to path, renames it over the original and returns its size."""
+    # Per-thread temp name so a writer in a worker thread never shares one with the event loop
+    tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    with open(tmp, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp, path)
+    return size
+
+def _count_write(kind: str, size: int):
+    metrics.PROJECT_SAVES.inc(kind=kind)
+    metrics.PROJECT_BYTES_WRITTEN.inc(size, kind=kind)
+
+def _project_exists_on_disk(project_id: str) -> bool:
+    p_dir = get_project_dir(project_id)
+    return (p_dir / SNAPSHOT_FILE).exists() or (p_dir / LEGACY_FILE).exists()
+
+def _snapshot_json(project: Project, seq: int) -> str:
+    return '{"seq": %d, "project": %s}' % (seq, project.model_dump_json())
+
+def _write_snapshot(project_id: str, data: str, truncate_journal: bool):
+    p_dir = get_project_dir(project_id)
     os.makedirs(p_dir, exist_ok=True)
-    with open(p_dir / "project.json", "w") as f:
-        f.write(project.model_dump_json(indent=2))
+    _count_write("snapshot", _write_atomic(p_dir / SNAPSHOT_FILE, data))
+    if truncate_journal:
+        # Records up to the snapshot's seq are skipped on replay, so a crash
+        # before this truncate is harmless.
+        with open(p_dir / JOURNAL_FILE, "w"):
+            pass
 
-def load_project(project_id: str) -> Project:
+def _append_journal(project_id: str, lines: List[str]) -> int:
+    """Appends records to the journal and returns its new size in bytes."""
     p_dir = get_project_dir(project_id)
-    p_file = p_dir / "project.json"
-    if p_file.exists():
-        with open(p_file, "r") as f:
-            return Project.model_validate_json(f.read())
-    return None
+    os.makedirs(p_dir, exist_ok=True)
+    with open(p_dir / JOURNAL_FILE, "a") as f:
+        start = f.tell()
+        f.write("".join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    _count_write("journal", size - start)
+    return size
+
+def _migrate_legacy(project_id: str):
+    """Converts a legacy project.json into a snapshot, keeping the original as a .bak."""
+    p_dir = get_project_dir(project_id)
+    with open(p_dir / LEGACY_FILE, "r") as f:
+        p = Project.model_validate_json(f.read())
+    _write_snapshot(project_id, _snapshot_json(p, 0), truncate_journal=True)
+    os.replace(p_dir / LEGACY_FILE, p_dir / (LEGACY_FILE + ".bak"))
+    print(f"Migrated project {project_id} to journal format")
+
+def _read_project(project_id: str, repair: bool = False):
+    """Loads the snapshot and replays the journal on top of it. Returns (project, seq).
+
+    A torn last record is skipped. Only with repair is it also cut from the
+    journal, which the caller may do only while no writer can be appending.
+    """
+    p_dir = get_project_dir(project_id)
+    if not (p_dir / SNAPSHOT_FILE).exists():
+        if not (p_dir / LEGACY_FILE).exists():
+            return None, 0
+        _migrate_legacy(project_id)
+
+    with open(p_dir / SNAPSHOT_FILE, "r") as f:
+        snap = json.load(f)
+    base_seq = snap.get("seq", 0)
+    data = snap["project"]
+    seq = base_seq
+
+    j_file = p_dir / JOURNAL_FILE
+    if j_file.exists():
+        good_offset = 0
+        torn = False
+        with open(j_file, "rb") as f:
+            for raw in f:
+                try:
+                    rec = json.loads(raw)
+                except ValueError:
+                    # A crash mid-append leaves a partial last line
+                    torn = True
+                    break
+                good_offset += len(raw)
+                if rec["seq"] <= base_seq:
+                    continue
+                if rec["op"] == "node":
+                    data["nodes"][rec["node"]["id"]] = rec["node"]
+                elif rec["op"] == "project":
+                    data.update(rec["fields"])
+                seq = rec["seq"]
+        if torn and repair:
+            with open(j_file, "r+b") as f:
+                f.truncate(good_offset)
+
+    return Project.model_validate(data), seq
+
+def _disk_mtime_ns(project_id: str) -> int:
+    p_dir = get_project_dir(project_id)
+    mtime = 0
+    for name in (SNAPSHOT_FILE, JOURNAL_FILE, LEGACY_FILE):
+        try:
+            mtime = max(mtime, os.stat(p_dir / name).st_mtime_ns)
+        except FileNotFoundError:
+            pass
+    return mtime
+
+def _summarize(p: Project) -> dict:
+    entry = ProjectSummary(
+        id=p.id, name=p.name, created_at=p.created_at, updated_at=p.updated_at,
+        node_count=len(p.nodes), revision=p.revision
+    ).model_dump()
+    latest = None
+    for node in p.nodes.values():
+        if node.image_filename and node.status == "completed":
+            if latest is None or node.timestamp > latest.timestamp:
+                latest = node
+    if latest:
+        entry["thumbnail_node_id"] = latest.id
+        entry["thumbnail"] = latest.image_filename
+    return entry
+
+def _set_index_entry(project_id: str, entry: dict):
+    global _index_dirty
+    PROJECT_INDEX[project_id] = entry
+    _index_dirty = True
+
+def _index_node(p: Project, node: GenerationNode, is_new: bool):
+    """Incrementally updates the summary of p after node was stored."""
+    global _index_dirty
+    entry = PROJECT_INDEX.get(p.id)
+    if entry is None:
+        _set_index_entry(p.id, dict(_summarize(p), mtime_ns=0))
+        return
+    entry["updated_at"] = p.updated_at
+    entry["revision"] = p.revision
+    if is_new:
+        entry["node_count"] += 1
+    if node.image_filename and node.status == "completed":
+        thumb = p.nodes.get(entry.get("thumbnail_node_id"))
+        if thumb is None or node.timestamp >= thumb.timestamp:
+            entry["thumbnail_node_id"] = node.id
+            entry["thumbnail"] = node.image_filename
+    _index_dirty = True
+
+def _touch_index_mtime(project_id: str):
+    global _index_dirty
+    entry = PROJECT_INDEX.get(project_id)
+    if entry is not None:
+        entry["mtime_ns"] = _disk_mtime_ns(project_id)
+        _index_dirty = True
+
+def _load_index():
+    global _index_loaded
+    if _index_loaded:
+        return
+    _index_loaded = True
+    try:
+        with open(PROJECTS_DIR / INDEX_FILE, "r") as f:
+            for project_id, entry in json.load(f).get("projects", {}).items():
+                # Entries updated in memory before the file was read are newer
+                PROJECT_INDEX.setdefault(project_id, entry)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Project index is unreadable, rebuilding: {e}")
+
+def _pending_index_json():
+    """Serializes the index if it changed since the last write, else returns None."""
+    global _index_dirty
+    if not _index_dirty:
+        return None
+    _index_dirty = False
+    return json.dumps({"projects": PROJECT_INDEX})
+
+def _write_index_file(data: str):
+    init_projects_dir()
+    _count_write("index", _write_atomic(PROJECTS_DIR / INDEX_FILE, data))
+
+def _write_index():
+    data = _pending_index_json()
+    if data is not None:
+        _write_index_file(data)
 
-def get_all_projects():
+def get_project_summaries() -> List[ProjectSummary]:
+    """Lists projects from the summary index, rebuilding only entries whose files changed on disk."""
+    global _index_dirty
     init_projects_dir()
-    projects = []
+    _load_index()
+    seen = set()
     for d in os.listdir(PROJECTS_DIR):
-        p_dir = PROJECTS_DIR / d
-        if p_dir.is_dir() and (p_dir / "project.json").exists():
-            projects.append(load_project(d))
+        if d in PROJECT_CACHE:
+            seen.add(d)
+            if d not in PROJECT_INDEX:
+                _set_index_entry(d, dict(_summarize(PROJECT_CACHE[d]), mtime_ns=_disk_mtime_ns(d)))
+            continue
+        if not (PROJECTS_DIR / d).is_dir() or not _project_exists_on_disk(d):
+            continue
+        seen.add(d)
+        mtime = _disk_mtime_ns(d)
+        entry = PROJECT_INDEX.get(d)
+        if entry is None or entry.get("mtime_ns", 0) < mtime or "revision" not in entry:
+            # Stale or missing: re-read without keeping the full project resident
+            try:
+                p, _ = _read_project(d)
+            except Exception as e:
+                print(f"Error indexing project {d}: {e}")
+                continue
+            _set_index_entry(d, dict(_summarize(p), mtime_ns=_disk_mtime_ns(d)))
+    for project_id in list(PROJECT_INDEX):
+        if project_id not in seen:
+            del PROJECT_INDEX[project_id]
+            _index_dirty = True
+    _write_index()
+    summaries = [ProjectSummary.model_validate(e) for e in PROJECT_INDEX.values()]
     # Sort by updated_at descending
-    projects.sort(key=lambda x: x.updated_at, reverse=True)
-    return projects
+    summaries.sort(key=lambda x: x.updated_at, reverse=True)
+    return summaries
+
+def save_project(project: Project):
+    """Writes a full snapshot of a project immediately and makes it the cached copy."""
+    PROJECT_CACHE[project.id] = project
+    NODE_INDEXES.pop(project.id, None)
+    DIRTY_PROJECTS.discard(project.id)
+    DIRTY_NODES.pop(project.id, None)
+    seq = JOURNAL_SEQ.get(project.id, 0)
+    JOURNAL_SEQ[project.id] = seq
+    _write_snapshot(project.id, _snapshot_json(project, seq), truncate_journal=True)
+    _set_index_entry(project.id, dict(_summarize(project), mtime_ns=_disk_mtime_ns(project.id)))
+
+def load_project(project_id: str) -> Project:
+    if project_id in PROJECT_CACHE:
+        return PROJECT_CACHE[project_id]
+    with metrics.stage(metrics.STORAGE_SECONDS, "project_load"):
+        # The tail must go before the project's next append lands after it. Writers
+        # hold the lock, and a project that isn't resident has none running.
+        p, seq = _read_project(project_id, repair=not project_lock(project_id).locked())
+    if p:
+        PROJECT_CACHE[project_id] = p
+        JOURNAL_SEQ[project_id] = seq
+    return p
+
+def peek_project(project_id: str) -> Optional[Project]:
+    """Returns the resident copy of a project, or reads it from disk without making it resident."""
+    p = PROJECT_CACHE.get(project_id)
+    if p is None:
+        p, _ = _read_project(project_id)
+    return p
 
 def create_project(name: str = "New Project") -> Project:
     init_projects_dir()
@@ -42,11 +369,242 @@ def create_project(name: str = "New Project") -> Project:
     save_project(p)
     return p
 
-def add_node_to_project(project_id: str, node: GenerationNode):
+def mark_dirty(project_id: str, node_id: str = None):
+    """Flags a project (and optionally one of its nodes) for the next flush."""
+    DIRTY_PROJECTS.add(project_id)
+    if node_id:
+        DIRTY_NODES.setdefault(project_id, set()).add(node_id)
+
+def add_node_to_project(project_id: str, node: GenerationNode, persist: bool = True):
+    """Stores node in the cached project.
+
+    With persist=False the change is transient (e.g. a progress tick) and is
+    kept in memory only; it never schedules a disk write on its own.
+    """
     p = load_project(project_id)
     if p:
+        is_new = node.id not in p.nodes
         p.nodes[node.id] = node
-        p.updated_at = node.timestamp
-        save_project(p)
+        if persist:
+            p.updated_at = node.timestamp
+            _node_changed(p, node, is_new)
+        _update_node_index(p, node)
         return True
     return False
+
+def _node_changed(p: Project, node: GenerationNode, is_new: bool):
+    p.revision += 1
+    node.revision = p.revision
+    mark_dirty(p.id, node.id)
+    _index_node(p, node, is_new)
+    search.note_node(p.id, node)
+
+def get_node(project_id: str, node_id: str) -> Optional[GenerationNode]:
+    p = load_project(project_id)
+    return p.nodes.get(node_id) if p else None
+
+def update_node(project_id: str, node_id: str, persist: bool = True, expect_status: str = None, **changes) -> Optional[GenerationNode]:
+    """Merges changes into the stored node and returns it.
+
+    Only the given fields are written, so a caller holding an older copy of
+    the node can't overwrite what others changed. With expect_status the
+    update is skipped (returning None) unless the node is still in that
+    status, e.g. a late progress tick can't revive a cancelled node.
+    """
+    p = load_project(project_id)
+    node = p.nodes.get(node_id) if p else None
+    if node is None or (expect_status is not None and node.status != expect_status):
+        return None
+    for field, value in changes.items():
+        setattr(node, field, value)
+    if persist:
+        p.updated_at = max(p.updated_at, node.timestamp)
+        _node_changed(p, node, False)
+    _update_node_index(p, node)
+    return node
+
+def add_nodes_to_project(project_id: str, nodes: List[GenerationNode]):
+    """Stores several nodes at once; they are persisted together by the next flush."""
+    p = load_project(project_id)
+    if not p:
+        return False
+    for node in nodes:
+        is_new = node.id not in p.nodes
+        p.nodes[node.id] = node
+        p.updated_at = max(p.updated_at, node.timestamp)
+        _node_changed(p, node, is_new)
+        _update_node_index(p, node)
+    return True
+
+def _update_node_index(p: Project, node: GenerationNode):
+    idx = NODE_INDEXES.get(p.id)
+    if idx is not None and idx.project is p:
+        idx.update(node)
+
+def get_node_index(p: Project) -> NodeIndex:
+    idx = NODE_INDEXES.get(p.id)
+    # Rebuilt when the cached project object was replaced
+    if idx is None or idx.project is not p:
+        idx = NODE_INDEXES[p.id] = NodeIndex(p)
+    return idx
+
+def encode_cursor(key: Tuple[str, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Raises ValueError for cursors not produced by encode_cursor."""
+    try:
+        timestamp, node_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(timestamp), str(node_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def get_nodes_page(project_id: str, limit: int = 100, cursor: str = None, since: int = None, parent_id: str = None) -> Optional[NodePage]:
+    """Returns a page of a project's nodes, or None if the project doesn't exist.
+
+    Without since, nodes come in timestamp order and cursor continues after the
+    previous page. With since, only nodes changed after that revision are
+    returned, oldest change first. parent_id restricts either to the subtree
+    below that node.
+    """
+    p = load_project(project_id)
+    if not p:
+        return None
+    idx = get_node_index(p)
+    subtree = idx.descendants(parent_id) if parent_id else None
+
+    if since is not None:
+        changed = []
+        for node_id, revision in reversed(idx.by_revision.items()):
+            if revision <= since:
+                break
+            if subtree is None or node_id in subtree:
+                changed.append(node_id)
+        changed.reverse()
+        page = changed[:limit]
+        has_more = len(changed) > limit
+        nodes = [p.nodes[node_id] for node_id in page]
+        revision = nodes[-1].revision if has_more else p.revision
+        return NodePage(nodes=nodes, revision=revision, has_more=has_more)
+
+    keys = idx.by_time if subtree is None else sorted(idx.keys[node_id] for node_id in subtree)
+    start = bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+    page = keys[start:start + limit]
+    has_more = start + limit < len(keys)
+    return NodePage(
+        nodes=[p.nodes[node_id] for _, node_id in page],
+        next_cursor=encode_cursor(page[-1]) if has_more else None,
+        revision=p.revision,
+        has_more=has_more,
+    )
+
+def _pending_records(project_id: str, p: Project) -> List[str]:
+    """Serializes the dirty state of a project into journal lines, assigning sequence numbers."""
+    seq = JOURNAL_SEQ.get(project_id, 0)
+    lines = []
+    for node_id in DIRTY_NODES.pop(project_id, ()):
+        node = p.nodes.get(node_id)
+        if node is None:
+            continue
+        seq += 1
+        lines.append('{"seq": %d, "op": "node", "node": %s}\n' % (seq, node.model_dump_json()))
+    seq += 1
+    fields = p.model_dump_json(exclude={"nodes"})
+    lines.append('{"seq": %d, "op": "project", "fields": %s}\n' % (seq, fields))
+    JOURNAL_SEQ[project_id] = seq
+    return lines
+
+async def compact_project(project_id: str):
+    """Folds the journal into a fresh snapshot. Flushes of this project wait until it finishes."""
+    p = PROJECT_CACHE.get(project_id)
+    if not p or project_id in COMPACTING:
+        return
+    COMPACTING.add(project_id)
+    try:
+        async with project_lock(project_id):
+            seq = JOURNAL_SEQ.get(project_id, 0)
+            # Shallow copy so the nodes dict can keep changing while the thread serializes
+            snapshot = p.model_copy(update={"nodes": dict(p.nodes)})
+            await asyncio.to_thread(
+                lambda: _write_snapshot(project_id, _snapshot_json(snapshot, seq), truncate_journal=True)
+            )
+            _touch_index_mtime(project_id)
+    except Exception as e:
+        print(f"Error compacting project {project_id}: {e}")
+    finally:
+        COMPACTING.discard(project_id)
+
+async def _flush_project(project_id: str, p: Project):
+    try:
+        async with project_lock(project_id):
+            # Flushed by someone else while this waited for the lock
+            if project_id not in DIRTY_PROJECTS:
+                return
+            DIRTY_PROJECTS.discard(project_id)
+            lines = _pending_records(project_id, p)
+            size = await asyncio.to_thread(_append_journal, project_id, lines)
+    except Exception as e:
+        print(f"Error flushing project {project_id}: {e}")
+        # Journal state is unknown now; a snapshot is the safe recovery
+        mark_dirty(project_id)
+        asyncio.create_task(compact_project(project_id))
+        return
+    _touch_index_mtime(project_id)
+    if size > JOURNAL_COMPACT_BYTES:
+        asyncio.create_task(compact_project(project_id))
+
+async def flush_project(project_id: str):
+    """Appends a project's dirty nodes to its journal now rather than at the next flush.
+
+    For changes other state depends on being durable, e.g. a node's final status
+    before its job is marked finished.
+    """
+    p = PROJECT_CACHE.get(project_id)
+    if p is None or project_id not in DIRTY_PROJECTS:
+        return
+    # Shielded for the same reason as in run_flusher
+    await asyncio.shield(_flush_project(project_id, p))
+
+async def flush_dirty_projects():
+    """Appends the dirty nodes of every dirty project to its journal."""
+    for project_id in list(DIRTY_PROJECTS):
+        if project_lock(project_id).locked():
+            # Being compacted; it stays dirty for the next flush
+            continue
+        p = PROJECT_CACHE.get(project_id)
+        if not p:
+            DIRTY_PROJECTS.discard(project_id)
+            continue
+        await _flush_project(project_id, p)
+    data = _pending_index_json()
+    if data is None:
+        return
+    try:
+        await asyncio.to_thread(_write_index_file, data)
+    except Exception as e:
+        print(f"Error writing project index: {e}")
+
+async def run_flusher(interval: float = None):
+    """Background task that periodically flushes dirty projects."""
+    interval = interval or FLUSH_INTERVAL
+    flush = None
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            # Shielded: cancelling mid-append would release the project lock
+            # while the worker thread is still writing the journal
+            flush = asyncio.ensure_future(flush_dirty_projects())
+            await asyncio.shield(flush)
+    finally:
+        if flush is not None and not flush.done():
+            await flush
+        # Final flush on shutdown so nothing marked dirty is lost. A compaction
+        # still running would truncate the journal after this append; wait it out.
+        for project_id in list(DIRTY_PROJECTS):
+            p = PROJECT_CACHE.get(project_id)
+            if p:
+                async with project_lock(project_id):
+                    _append_journal(project_id, _pending_records(project_id, p))
+                _touch_index_mtime(project_id)
+        DIRTY_PROJECTS.clear()
+        _write_index()
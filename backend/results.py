@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+import database
+
+# Cached outputs and their index, under the projects directory
+RESULTS_DIR = ".results"
+RESULTS_DB = "results.db"
+# Total size of cached outputs before the least recently used ones are evicted; 0 disables the cache
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("COMFYSTUDIO_RESULT_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+
+# Counters since startup
+STATS = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+_db: sqlite3.Connection = None
+
+def enabled() -> bool:
+    return RESULT_CACHE_MAX_BYTES > 0
+
+def results_dir() -> Path:
+    return database.path(RESULTS_DIR)
+
+def get_db() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        _db = database.connect(results_dir() / RESULTS_DB)
+        _db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                sha256 TEXT
+            )
+        """)
+        database.add_column(_db, "results", "sha256", "TEXT")
+        _db.execute("CREATE INDEX IF NOT EXISTS results_by_use ON results (last_used)")
+    return _db
+
+def close():
+    global _db
+    if _db is not None:
+        _db.close()
+        _db = None
+
+def prompt_key(prompt: Dict[str, Any], save_node_id: str) -> str:
+    """Canonical hash of a fully injected prompt graph and the node whose output is kept."""
+    canonical = json.dumps([prompt, save_node_id], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _link_or_copy(src: Path, dest: Path):
+    # Outputs are never modified in place, so a hardlink is a safe zero-copy dedup
+    tmp = dest.with_name(dest.name + ".part")
+    if tmp.exists():
+        tmp.unlink()
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+def _forget(key: str):
+    get_db().execute("DELETE FROM results WHERE key = ?", (key,))
+
+async def restore(key: str, dest_dir: Path, stem: str) -> Optional[Tuple[str, Optional[str]]]:
+    """Places the cached output for key into dest_dir as stem + ext.
+
+    Returns (new filename, SHA-256 hex digest of its contents if known), or None on a miss.
+    """
+    if not enabled():
+        return None
+    row = get_db().execute("SELECT filename, sha256 FROM results WHERE key = ?", (key,)).fetchone()
+    if row is not None:
+        blob = results_dir() / row["filename"]
+        filename = stem + blob.suffix
+        try:
+            os.makedirs(dest_dir, exist_ok=True)
+            await asyncio.to_thread(_link_or_copy, blob, dest_dir / filename)
+        except OSError as e:
+            print(f"Cached result {key} unusable: {e}")
+            _forget(key)
+        else:
+            get_db().execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            STATS["hits"] += 1
+            return filename, row["sha256"]
+    STATS["misses"] += 1
+    return None
+
+async def store(key: str, path: Path, sha256: str = None):
+    """Adds a freshly downloaded output, with the digest of its contents, to the cache and evicts down to the size limit."""
+    if not enabled():
+        return
+    filename = key + path.suffix
+    try:
+        await asyncio.to_thread(_link_or_copy, path, results_dir() / filename)
+    except OSError as e:
+        print(f"Could not cache result {path.name}: {e}")
+        return
+    get_db().execute(
+        "INSERT OR REPLACE INTO results (key, filename, size, last_used, sha256) VALUES (?, ?, ?, ?, ?)",
+        (key, filename, path.stat().st_size, time.time(), sha256),
+    )
+    STATS["stores"] += 1
+    evict()
+
+def evict():
+    """Drops least recently used entries until the cache fits RESULT_CACHE_MAX_BYTES."""
+    db = get_db()
+    total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    if total <= RESULT_CACHE_MAX_BYTES:
+        return
+    for row in db.execute("SELECT key, filename, size FROM results ORDER BY last_used").fetchall():
+        if total <= RESULT_CACHE_MAX_BYTES:
+            break
+        try:
+            (results_dir() / row["filename"]).unlink()
+        except FileNotFoundError:
+            pass
+        _forget(row["key"])
+        total -= row["size"]
+        STATS["evictions"] += 1
+
+def stats() -> Dict[str, Any]:
+    entries, size = (0, 0)
+    if enabled():
+        entries, size = get_db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+    lookups = STATS["hits"] + STATS["misses"]
+    return dict(
+        STATS,
+        enabled=enabled(),
+        entries=entries,
+        bytes=size,
+        max_bytes=RESULT_CACHE_MAX_BYTES,
+        hit_ratio=STATS["hits"] / lookups if lookups else 0.0,
+    )
@@ -0,0 +1,263 @@
+import os
+import uuid
+import asyncio
+import itertools
+from typing import List, Dict
+from models import GenerationNode, GenerationParams, BatchGenerateRequest, BatchStatus, JobInfo
+import projects
+import generation
+import templates
+import comfyui
+import jobs
+
+# Number of prompts submitted to ComfyUI at the same time; 0 means IN_FLIGHT_PER_BACKEND
+# for every backend, so one can start its next prompt while the last one downloads
+MAX_IN_FLIGHT = int(os.environ.get("COMFYSTUDIO_MAX_IN_FLIGHT", "0"))
+IN_FLIGHT_PER_BACKEND = 2
+# Running jobs allowed per project, so one project's batch can't take every slot;
+# 0 means one per backend, which lets a single batch keep the whole pool busy
+MAX_IN_FLIGHT_PER_PROJECT = int(os.environ.get("COMFYSTUDIO_MAX_IN_FLIGHT_PER_PROJECT", "0"))
+# Lower runs first; interactive renders overtake queued batch items
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+# Largest parameter matrix a single batch request may expand to
+MAX_BATCH_SIZE = int(os.environ.get("COMFYSTUDIO_MAX_BATCH_SIZE", "1000"))
+
+# node id -> (project id, task) for jobs running in this process
+RUNNING: Dict[str, tuple] = {}
+_wakeup: asyncio.Event = None
+_dispatcher: asyncio.Task = None
+
+async def start():
+    """Opens the job store, resumes jobs interrupted by a restart and starts dispatching."""
+    global _wakeup, _dispatcher
+    if _dispatcher is not None:
+        return
+    _wakeup = asyncio.Event()
+    jobs.prune()
+    await _recover()
+    _dispatcher = asyncio.create_task(_dispatch_loop())
+
+async def stop():
+    """Stops dispatching. Running jobs stay 'running' in the store and resume on next start."""
+    global _dispatcher
+    tasks = [t for _, t in RUNNING.values()]
+    if _dispatcher:
+        tasks.append(_dispatcher)
+        _dispatcher = None
+    for t in tasks:
+        t.cancel()
+    for t in tasks:
+        try:
+            await t
+        except asyncio.CancelledError:
+            pass
+    RUNNING.clear()
+    jobs.close()
+
+def _wake():
+    if _wakeup is not None:
+        _wakeup.set()
+
+async def _recover():
+    # Cancelled before the restart, but the node's "Cancelled." may not have reached disk
+    for job in jobs.list_by_status("cancelling"):
+        await _finish_cancel(job)
+    for job in jobs.list_by_status("running"):
+        if job["prompt_id"]:
+            _spawn(job)
+        else:
+            # Never reached ComfyUI, just run it again
+            jobs.requeue(job["node_id"])
+
+def _load_node(job):
+    return projects.get_node(job["project_id"], job["node_id"])
+
+def _spawn(job):
+    RUNNING[job["node_id"]] = (job["project_id"], asyncio.create_task(_run_job(job)))
+
+async def _run_job(job):
+    node_id = job["node_id"]
+    project_id = job["project_id"]
+    try:
+        node = _load_node(job)
+        if node is None:
+            jobs.set_status(node_id, "done", expect_status="running")
+            return
+        if job["prompt_id"]:
+            if not await generation.resume_generation(project_id, node, job["prompt_id"], job["server"]):
+                jobs.requeue(node_id)
+                return
+        else:
+            await generation.run_generation(
+                project_id, node, on_queued=lambda prompt_id, server: jobs.set_prompt_id(node_id, prompt_id, server)
+            )
+        # The node's final status must be on disk before the job stops being recovered;
+        # a cancel that raced the finish keeps its status
+        await projects.flush_project(project_id)
+        jobs.set_status(node_id, "done", expect_status="running")
+    except asyncio.CancelledError:
+        # Shutdown leaves the job 'running' for recovery; cancel() already marked it
+        raise
+    except Exception as e:
+        print(f"Generation of node {node_id} failed: {e}")
+        node = _load_node(job)
+        if node:
+            generation.fail_node(project_id, node, f"Generation failed: {e}")
+        await projects.flush_project(project_id)
+        jobs.set_status(node_id, "done", expect_status="running")
+    finally:
+        RUNNING.pop(node_id, None)
+        _wake()
+
+def max_in_flight() -> int:
+    return MAX_IN_FLIGHT or IN_FLIGHT_PER_BACKEND * len(comfyui.get_backends())
+
+def max_in_flight_per_project() -> int:
+    return MAX_IN_FLIGHT_PER_PROJECT or len(comfyui.get_backends())
+
+def _next_job():
+    """Highest-priority queued job whose project is below its concurrency limit."""
+    per_project: Dict[str, int] = {}
+    for project_id, _ in RUNNING.values():
+        per_project[project_id] = per_project.get(project_id, 0) + 1
+    limit = max_in_flight_per_project()
+    for job in jobs.iter_queued():
+        if per_project.get(job["project_id"], 0) < limit:
+            return job
+    return None
+
+async def _dispatch_loop():
+    while True:
+        _wakeup.clear()
+        while len(RUNNING) < max_in_flight():
+            job = _next_job()
+            if job is None:
+                break
+            jobs.set_status(job["node_id"], "running")
+            _spawn(job)
+        await _wakeup.wait()
+
+def submit(project_id: str, node: GenerationNode, priority: int = PRIORITY_INTERACTIVE):
+    """Queues a node that is already stored in its project for generation."""
+    jobs.add(project_id, [node.id], priority)
+    _wake()
+
+def batch_size(req: BatchGenerateRequest) -> int:
+    size = 1
+    if req.seeds:
+        size *= len(req.seeds)
+    elif req.seed_range:
+        size *= max(req.seed_range.count, 0)
+    for axis in (req.cfgs, req.steps):
+        if axis:
+            size *= len(axis)
+    for values in (req.template_values or {}).values():
+        if values:
+            size *= len(values)
+    return size
+
+def expand_batch(req: BatchGenerateRequest) -> List[GenerationParams]:
+    """Expands the parameter matrix of a batch request into one params object per cell."""
+    base = req.params
+    if req.seeds:
+        seeds = req.seeds
+    elif req.seed_range:
+        seeds = [req.seed_range.start + i * req.seed_range.step for i in range(req.seed_range.count)]
+    else:
+        seeds = [base.seed]
+    cfgs = req.cfgs or [base.cfg]
+    steps = req.steps or [base.steps]
+    tv_axes = {k: v for k, v in (req.template_values or {}).items() if v}
+    tv_keys = list(tv_axes)
+    prompt_template = base.prompt_template or base.prompt
+
+    out = []
+    for combo in itertools.product(*(tv_axes[k] for k in tv_keys)):
+        if tv_keys:
+            values = dict(base.template_values or {}, **dict(zip(tv_keys, combo)))
+            fields = {
+                "template_values": values,
+                "prompt_template": prompt_template,
+                "prompt": templates.render_prompt(prompt_template, values),
+            }
+        else:
+            fields = {}
+        for seed, cfg, step_count in itertools.product(seeds, cfgs, steps):
+            out.append(base.model_copy(update=dict(fields, seed=seed, cfg=cfg, steps=step_count)))
+    return out
+
+def submit_batch(project_id: str, nodes: List[GenerationNode]) -> str:
+    """Queues nodes as one batch at batch priority and returns the batch id."""
+    batch_id = str(uuid.uuid4())
+    jobs.add(project_id, [n.id for n in nodes], PRIORITY_BATCH, batch_id=batch_id)
+    _wake()
+    return batch_id
+
+async def cancel(node_id: str) -> bool:
+    """Cancels a queued or running job, removing its prompt from ComfyUI if it got there."""
+    job = jobs.get(node_id)
+    if job is None or job["status"] not in jobs.ACTIVE_STATUSES:
+        return False
+    node = _load_node(job)
+    if node is not None and node.status != "generating":
+        # Finished already; the job only waits for that to reach disk
+        return False
+    # 'cancelling' takes it out of dispatch; it becomes 'cancelled' once the node's status is durable
+    if not jobs.set_status(node_id, "cancelling", expect_status=job["status"]):
+        return False
+    # Stop our side and mark the node before awaiting ComfyUI, so the interrupt
+    # can't surface as a generation failure
+    running = RUNNING.pop(node_id, None)
+    if running:
+        running[1].cancel()
+    _wake()
+    await _finish_cancel(jobs.get(node_id))
+    return True
+
+async def _finish_cancel(job):
+    node = _load_node(job)
+    # A node that already finished keeps its result
+    if node:
+        generation.fail_node(job["project_id"], node, "Cancelled.")
+    await projects.flush_project(job["project_id"])
+    jobs.set_status(job["node_id"], "cancelled", expect_status="cancelling")
+    if job["prompt_id"]:
+        await comfyui.cancel_prompt(job["prompt_id"], job["server"])
+
+def set_priority(node_id: str, priority: int) -> bool:
+    if jobs.set_priority(node_id, priority):
+        _wake()
+        return True
+    return False
+
+def list_jobs(project_id: str = None) -> List[JobInfo]:
+    return [JobInfo.model_validate(j) for j in jobs.list_active(project_id)]
+
+def get_batch_status(batch_id: str) -> BatchStatus:
+    batch_jobs = jobs.list_batch(batch_id)
+    if not batch_jobs:
+        return None
+    project_id = batch_jobs[0]["project_id"]
+    p = projects.load_project(project_id)
+    counts: Dict[str, int] = {"generating": 0, "completed": 0, "error": 0}
+    progress = 0.0
+    node_ids = [j["node_id"] for j in batch_jobs]
+    for node_id in node_ids:
+        node = p.nodes.get(node_id) if p else None
+        if node is None:
+            continue
+        counts[node.status] = counts.get(node.status, 0) + 1
+        progress += 1.0 if node.status in ("completed", "error") else node.progress
+    total = len(node_ids)
+    return BatchStatus(
+        id=batch_id,
+        project_id=project_id,
+        created_at=batch_jobs[0]["created_at"],
+        node_ids=node_ids,
+        total=total,
+        generating=counts["generating"],
+        completed=counts["completed"],
+        error=counts["error"],
+        progress=progress / total if total else 1.0,
+    )
@@ -0,0 +1,269 @@
+import os
+import re
+import json
+import sqlite3
+import asyncio
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Any
+from models import GenerationNode, SearchHit, SearchResults
+import projects
+import database
+
+# Under the projects directory
+SEARCH_DB = "search.db"
+# Seconds between batched writes of changed nodes into the index
+SEARCH_FLUSH_INTERVAL = float(os.environ.get("COMFYSTUDIO_SEARCH_FLUSH_INTERVAL", "1.0"))
+MAX_RESULTS = 200
+# Matches are counted up to this many; beyond it the total is a lower bound
+COUNT_LIMIT = 1000
+
+# bm25 weights of the FTS columns, in table order
+FTS_WEIGHTS = (10.0, 1.0, 3.0, 3.0, 5.0, 2.0)
+
+# Projects created after this were indexed node by node from the start
+_started_at = datetime.now().isoformat()
+
+# node id -> (project id, row) waiting for the next flush
+PENDING: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+
+_db: sqlite3.Connection = None
+# Index writes happen in a worker thread, queries in others; one connection, one at a time
+_db_lock = threading.Lock()
+# Keeps a flush and a backfill from writing rows of the same node out of order
+_write_lock = asyncio.Lock()
+
+def get_db() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        _db = database.connect(database.path(SEARCH_DB))
+        # Narrow rows so filters and counts scan little; the params JSON lives apart
+        _db.execute("""
+            CREATE TABLE IF NOT EXISTS nodes (
+                rowid INTEGER PRIMARY KEY,
+                node_id TEXT UNIQUE NOT NULL,
+                project_id TEXT NOT NULL,
+                workflow TEXT,
+                model TEXT,
+                lora TEXT,
+                seed INTEGER,
+                status TEXT,
+                timestamp TEXT,
+                image_filename TEXT
+            )
+        """)
+        _db.execute("CREATE TABLE IF NOT EXISTS node_params (rowid INTEGER PRIMARY KEY, params TEXT NOT NULL)")
+        _db.execute("CREATE INDEX IF NOT EXISTS nodes_by_project ON nodes (project_id, timestamp)")
+        _db.execute("CREATE INDEX IF NOT EXISTS nodes_by_time ON nodes (timestamp)")
+        for column in ("workflow", "model", "lora", "seed"):
+            _db.execute(f"CREATE INDEX IF NOT EXISTS nodes_by_{column} ON nodes ({column}, timestamp)")
+        # prefix= keeps short prefix queries ("wat*") from expanding over the whole vocabulary
+        _db.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS nodes_fts USING fts5(
+                prompt, negative_prompt, model, lora, template_values, workflow,
+                tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            )
+        """)
+        # Project revision the index last saw, to find projects changed while it wasn't running
+        _db.execute("CREATE TABLE IF NOT EXISTS indexed_projects (project_id TEXT PRIMARY KEY, revision INTEGER NOT NULL)")
+    return _db
+
+def close():
+    global _db
+    with _db_lock:
+        if _db is not None:
+            _db.close()
+            _db = None
+
+def _row(project_id: str, node: GenerationNode) -> Dict[str, Any]:
+    params = node.params
+    template_values = " ".join(f"{k} {v}" for k, v in (params.template_values or {}).items() if v)
+    return {
+        "node_id": node.id,
+        "project_id": project_id,
+        "workflow": params.workflow,
+        "model": params.model or None,
+        "lora": (params.lora or None) if not params.bypass_lora else None,
+        "seed": params.seed,
+        "status": node.status,
+        "timestamp": node.timestamp,
+        "image_filename": node.image_filename,
+        "params": params.model_dump_json(),
+        "revision": node.revision,
+        # Free-text columns
+        "prompt": params.prompt,
+        "negative_prompt": params.negative_prompt,
+        "template_values": template_values,
+    }
+
+def note_node(project_id: str, node: GenerationNode):
+    """Queues a changed node for the next index flush. Cheap enough to call on every change."""
+    PENDING[node.id] = (project_id, _row(project_id, node))
+
+def _write_rows(rows: List[Tuple[str, Dict[str, Any]]], revisions: Dict[str, int] = None):
+    with _db_lock:
+        db = get_db()
+        revisions = dict(revisions or {})
+        db.execute("BEGIN")
+        try:
+            for project_id, r in rows:
+                cur = db.execute(
+                    "INSERT INTO nodes (node_id, project_id, workflow, model, lora, seed, status, timestamp, image_filename) "
+                    "VALUES (:node_id, :project_id, :workflow, :model, :lora, :seed, :status, :timestamp, :image_filename) "
+                    "ON CONFLICT(node_id) DO UPDATE SET project_id=excluded.project_id, workflow=excluded.workflow, "
+                    "model=excluded.model, lora=excluded.lora, seed=excluded.seed, status=excluded.status, "
+                    "timestamp=excluded.timestamp, image_filename=excluded.image_filename "
+                    "RETURNING rowid",
+                    r,
+                )
+                rowid = cur.fetchone()[0]
+                db.execute("INSERT OR REPLACE INTO node_params (rowid, params) VALUES (?, ?)", (rowid, r["params"]))
+                db.execute("DELETE FROM nodes_fts WHERE rowid = ?", (rowid,))
+                db.execute(
+                    "INSERT INTO nodes_fts (rowid, prompt, negative_prompt, model, lora, template_values, workflow) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (rowid, r["prompt"], r["negative_prompt"], r["model"] or "", r["lora"] or "", r["template_values"], r["workflow"]),
+                )
+                revisions[project_id] = max(revisions.get(project_id, 0), r["revision"])
+            db.executemany(
+                "INSERT INTO indexed_projects (project_id, revision) VALUES (?, ?) "
+                "ON CONFLICT(project_id) DO UPDATE SET revision = MAX(revision, excluded.revision)",
+                list(revisions.items()),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+async def flush():
+    """Writes every pending node change into the index in one transaction."""
+    async with _write_lock:
+        if not PENDING:
+            return
+        rows = list(PENDING.values())
+        PENDING.clear()
+        try:
+            await asyncio.to_thread(_write_rows, rows)
+        except Exception as e:
+            print(f"Error updating search index: {e}")
+            for project_id, r in rows:
+                PENDING.setdefault(r["node_id"], (project_id, r))
+
+def _indexed_revisions() -> Dict[str, int]:
+    with _db_lock:
+        return {r["project_id"]: r["revision"] for r in get_db().execute("SELECT * FROM indexed_projects")}
+
+async def backfill():
+    """Indexes projects whose revision differs from what the index last saw (new, legacy, or
+    changed while the server wasn't running), without keeping them resident."""
+    indexed = await asyncio.to_thread(_indexed_revisions)
+    for summary in projects.get_project_summaries():
+        # Projects created since the server started had every node queued by note_node
+        if indexed.get(summary.id) == summary.revision or summary.created_at >= _started_at:
+            continue
+        try:
+            p = await asyncio.to_thread(projects.peek_project, summary.id)
+        except Exception as e:
+            print(f"Error indexing project {summary.id}: {e}")
+            continue
+        async with _write_lock:
+            # Loaded by a request meanwhile: the resident copy is the newest
+            p = projects.PROJECT_CACHE.get(summary.id, p)
+            if p is None:
+                continue
+            rows = []
+            for n in list(p.nodes.values()):
+                # These rows supersede any older queued change
+                PENDING.pop(n.id, None)
+                rows.append((p.id, _row(p.id, n)))
+            await asyncio.to_thread(_write_rows, rows, {p.id: p.revision})
+        # Yield between projects so a big backfill doesn't starve requests
+        await asyncio.sleep(0)
+
+async def run_indexer(interval: float = None):
+    """Background task: backfills once, then flushes pending node changes periodically."""
+    interval = interval or SEARCH_FLUSH_INTERVAL
+    try:
+        await backfill()
+    except Exception as e:
+        print(f"Search backfill failed: {e}")
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await flush()
+    finally:
+        # Final flush on shutdown
+        if PENDING:
+            rows = list(PENDING.values())
+            PENDING.clear()
+            _write_rows(rows)
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+def fts_query(text: str) -> Optional[str]:
+    """Turns free text into an FTS5 query: every word must match, as a prefix."""
+    terms = _TERM.findall(text or "")
+    if not terms:
+        return None
+    return " ".join(f'"{t}"*' for t in terms)
+
+def _search(q: Optional[str], filters: Dict[str, Any], limit: int, offset: int) -> SearchResults:
+    where = []
+    args: List[Any] = []
+    match = fts_query(q)
+    for column in ("project_id", "workflow", "model", "lora", "seed", "status"):
+        value = filters.get(column)
+        if value is not None:
+            # With a text query the FTS index drives; "+" keeps SQLite from scanning a column index instead
+            where.append(f"{'+' if match else ''}n.{column} = ?")
+            args.append(value)
+    weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+    if match:
+        args = [match] + args
+        if where:
+            base = "FROM nodes_fts JOIN nodes n ON n.rowid = nodes_fts.rowid WHERE nodes_fts MATCH ?"
+        else:
+            # Rank inside the FTS table alone; joining every match before the sort doubles the cost
+            base = "FROM nodes_fts WHERE nodes_fts MATCH ?"
+        select = f"SELECT nodes_fts.rowid, bm25(nodes_fts, {weights}) AS score, snippet(nodes_fts, 0, '[', ']', '…', 12) AS snippet "
+        order = "ORDER BY score, nodes_fts.rowid DESC"
+    else:
+        base = "FROM nodes n WHERE 1"
+        select = "SELECT n.rowid, NULL AS score, NULL AS snippet "
+        order = "ORDER BY n.timestamp DESC"
+    if where:
+        base += " AND " + " AND ".join(where)
+    with _db_lock:
+        db = get_db()
+        # Counting every match of a broad query costs more than the page itself
+        total = db.execute(f"SELECT COUNT(*) FROM (SELECT 1 {base} LIMIT ?)", args + [COUNT_LIMIT + 1]).fetchone()[0]
+        page = db.execute(f"{select}{base} {order} LIMIT ? OFFSET ?", args + [limit, offset]).fetchall()
+        marks = ",".join("?" * len(page))
+        nodes = {
+            r["rowid"]: r for r in db.execute(
+                f"SELECT n.*, p.params FROM nodes n JOIN node_params p ON p.rowid = n.rowid WHERE n.rowid IN ({marks})",
+                [r["rowid"] for r in page],
+            )
+        }
+    hits = []
+    for rowid, score, snippet in page:
+        r = nodes[rowid]
+        hits.append(SearchHit(
+            project_id=r["project_id"],
+            node_id=r["node_id"],
+            timestamp=r["timestamp"],
+            status=r["status"],
+            image_filename=r["image_filename"],
+            params=json.loads(r["params"]),
+            # bm25 is lower-is-better; flip it so higher scores rank first
+            score=-score if score is not None else None,
+            snippet=snippet,
+        ))
+    return SearchResults(total=min(total, COUNT_LIMIT), total_exact=total <= COUNT_LIMIT, results=hits)
+
+async def search(q: str = None, limit: int = 50, offset: int = 0, **filters) -> SearchResults:
+    """Ranked full-text search over node params, narrowed by exact-match filters."""
+    # Include changes that haven't reached the index yet
+    await flush()
+    limit = max(1, min(limit, MAX_RESULTS))
+    return await asyncio.to_thread(_search, q, filters, limit, max(offset, 0))
@@ -0,0 +1,405 @@
+import os
+import time
+import shutil
+import sqlite3
+import asyncio
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from models import ProjectStorage, OrphanFile, StorageRun, StorageReport
+import projects
+import scheduler
+import media
+import metrics
+import database
+
+try:
+    from PIL import Image, PngImagePlugin
+except ImportError:
+    Image = None
+
+# Under the projects directory
+STORAGE_DB = "storage.db"
+# Seconds between storage passes
+STORAGE_INTERVAL = float(os.environ.get("COMFYSTUDIO_STORAGE_INTERVAL", "3600"))
+# Average disk throughput a pass may use for copying and recompressing media; 0 is unthrottled
+STORAGE_IO_BYTES_PER_SEC = int(os.environ.get("COMFYSTUDIO_STORAGE_IO_BYTES_PER_SEC", str(20 * 1024 * 1024)))
+# PNG outputs older than this many days are recompressed losslessly; 0 disables
+RECOMPRESS_AFTER_DAYS = float(os.environ.get("COMFYSTUDIO_RECOMPRESS_AFTER_DAYS", "0"))
+# Secondary directory for cold media, laid out as <dir>/<project id>/<file>; unset disables tiering
+COLD_STORAGE_DIR = Path(os.environ["COMFYSTUDIO_COLD_STORAGE_DIR"]) if os.environ.get("COMFYSTUDIO_COLD_STORAGE_DIR") else None
+# Media older than this many days is moved to COLD_STORAGE_DIR
+COLD_AFTER_DAYS = float(os.environ.get("COMFYSTUDIO_COLD_AFTER_DAYS", "30"))
+# Delete files no node references instead of only reporting them
+DELETE_ORPHANS = os.environ.get("COMFYSTUDIO_DELETE_ORPHANS", "0").lower() in ("1", "true", "yes")
+
+# Unreferenced files younger than this may belong to a generation that is just finishing
+ORPHAN_MIN_AGE = 3600
+# Recompressed files must shrink by at least this fraction to replace the original
+MIN_SAVING = 0.02
+COPY_CHUNK_SIZE = 1024 * 1024
+# Seconds between checks while a pass waits for generations to finish
+IDLE_POLL = 1.0
+MAX_REPORTED_ORPHANS = 1000
+# Files in a project folder that belong to the project itself rather than to a node
+PROJECT_FILES = {
+    projects.SNAPSHOT_FILE, projects.JOURNAL_FILE, projects.LEGACY_FILE, projects.LEGACY_FILE + ".bak",
+}
+
+LAST_RUN: Optional[StorageRun] = None
+
+_db: sqlite3.Connection = None
+_wakeup: asyncio.Event = None
+# Set on shutdown so a copy running in a worker thread stops between chunks
+_stopping = threading.Event()
+
+def get_db() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        _db = database.connect(database.path(STORAGE_DB))
+        # Files already recompressed (or found not worth it), so later passes skip them
+        _db.execute("""
+            CREATE TABLE IF NOT EXISTS recompressed (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            )
+        """)
+    return _db
+
+def close():
+    global _db
+    if _db is not None:
+        _db.close()
+        _db = None
+
+def cold_path(project_id: str, filename: str) -> Optional[Path]:
+    if COLD_STORAGE_DIR is None:
+        return None
+    return COLD_STORAGE_DIR / project_id / filename
+
+def locate(project_id: str, filename: str) -> Optional[Path]:
+    """Where a project file currently lives: the project folder, else cold storage."""
+    path = projects.get_project_dir(project_id) / filename
+    if path.is_file():
+        return path
+    cold = cold_path(project_id, filename)
+    if cold is not None and cold.is_file():
+        return cold
+    return None
+
+def is_busy() -> bool:
+    """True while any generation is running; storage work yields the disk to it."""
+    return bool(scheduler.RUNNING)
+
+class Throttle:
+    """Paces I/O to an average number of bytes per second."""
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._next = time.monotonic()
+
+    def delay(self, nbytes: int) -> float:
+        """Seconds to wait before moving nbytes more."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        start = max(self._next, now)
+        self._next = start + nbytes / self.rate
+        return start - now
+
+def _copy_paced(src: Path, dest: Path, throttle: Throttle, busy: Callable[[], bool]):
+    """Runs in a worker thread: copies src to dest in throttled chunks, pausing while busy()."""
+    os.makedirs(dest.parent, exist_ok=True)
+    tmp = dest.with_name(dest.name + ".part")
+    try:
+        with open(src, "rb") as fin, open(tmp, "wb") as fout:
+            while chunk := fin.read(COPY_CHUNK_SIZE):
+                while busy() and not _stopping.is_set():
+                    time.sleep(IDLE_POLL)
+                if _stopping.is_set():
+                    raise InterruptedError("storage manager stopped")
+                time.sleep(throttle.delay(len(chunk)))
+                fout.write(chunk)
+            fout.flush()
+            os.fsync(fout.fileno())
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dest)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+def _recompress_png(src: str, dest: str) -> int:
+    """Runs in a worker process: writes a maximally compressed copy of a PNG to dest.
+
+    Text chunks (ComfyUI stores the prompt and workflow there), the ICC profile
+    and DPI are kept, and the pixels are compared before returning the new size.
+    Returns 0 when the file can't be recompressed safely.
+    """
+    with Image.open(src) as im:
+        if im.format != "PNG" or getattr(im, "is_animated", False):
+            return 0
+        im.load()
+        info = PngImagePlugin.PngInfo()
+        for key, value in im.text.items():
+            info.add_text(key, value)
+        extra = {k: im.info[k] for k in ("icc_profile", "dpi", "transparency") if k in im.info}
+        im.save(dest, "PNG", optimize=True, pnginfo=info, **extra)
+        with Image.open(dest) as out:
+            if out.mode != im.mode or out.size != im.size or out.tobytes() != im.tobytes():
+                os.unlink(dest)
+                return 0
+    return os.path.getsize(dest)
+
+async def _wait_idle(run: StorageRun):
+    if not is_busy():
+        return
+    started = time.monotonic()
+    while is_busy():
+        await asyncio.sleep(IDLE_POLL)
+    run.paused_seconds += time.monotonic() - started
+
+async def _references() -> Dict[str, Optional[Tuple[str, Set[str], Set[str]]]]:
+    """project id -> (name, referenced filenames, ids of generating nodes).
+
+    None marks a project that couldn't be read; none of its files are touched.
+    """
+    refs = {}
+    for summary in projects.get_project_summaries():
+        p = projects.PROJECT_CACHE.get(summary.id)
+        if p is None:
+            try:
+                p = await asyncio.to_thread(projects.peek_project, summary.id)
+            except Exception as e:
+                print(f"Storage manager can't read project {summary.id}: {e}")
+                p = None
+        if p is None:
+            refs[summary.id] = None
+            continue
+        nodes = list(p.nodes.values())
+        refs[summary.id] = (
+            summary.name,
+            {n.image_filename for n in nodes if n.image_filename},
+            {n.id for n in nodes if n.status == "generating"},
+        )
+    return refs
+
+def _scan(refs) -> Tuple[List[ProjectStorage], List[Tuple[str, Path, os.stat_result]], List[Tuple[str, Path, os.stat_result, bool]]]:
+    """Runs in a worker thread: measures every project and sorts its files.
+
+    Returns (usage per project, referenced media as (project id, path, stat),
+    orphans as (project id, path, stat, in cold storage)).
+    """
+    now = time.time()
+    usage = []
+    media_files = []
+    orphans = []
+
+    def is_orphan(name: str, st: os.stat_result, referenced: Set[str], generating: Set[str]) -> bool:
+        stem = name.split(".", 1)[0]
+        return name not in referenced and stem not in generating and now - st.st_mtime > ORPHAN_MIN_AGE
+
+    for project_id, ref in refs.items():
+        if ref is None:
+            continue
+        name, referenced, generating = ref
+        entry = ProjectStorage(id=project_id, name=name)
+        p_dir = projects.get_project_dir(project_id)
+        referenced_stems = {f.rsplit(".", 1)[0] for f in referenced}
+        try:
+            entries = list(os.scandir(p_dir))
+        except FileNotFoundError:
+            entries = []
+        for e in entries:
+            if e.is_dir(follow_symlinks=False):
+                if e.name == media.DERIVED_DIR:
+                    for d in os.scandir(e.path):
+                        st = d.stat(follow_symlinks=False)
+                        # Derivatives are named <output stem>.<size>.<ext>
+                        if d.name.split(".", 1)[0] not in referenced_stems and now - st.st_mtime > ORPHAN_MIN_AGE:
+                            orphans.append((project_id, Path(d.path), st, False))
+                            entry.orphan_bytes += st.st_size
+                            entry.orphan_files += 1
+                        else:
+                            entry.derived_bytes += st.st_size
+                continue
+            st = e.stat(follow_symlinks=False)
+            if e.name in PROJECT_FILES or e.name.endswith(".tmp"):
+                entry.project_file_bytes += st.st_size
+            elif e.name in referenced:
+                entry.media_bytes += st.st_size
+                entry.media_files += 1
+                media_files.append((project_id, Path(e.path), st))
+            elif is_orphan(e.name, st, referenced, generating):
+                orphans.append((project_id, Path(e.path), st, False))
+                entry.orphan_bytes += st.st_size
+                entry.orphan_files += 1
+            else:
+                entry.media_bytes += st.st_size
+        cold_dir = cold_path(project_id, "")
+        if cold_dir is not None and cold_dir.is_dir():
+            for e in os.scandir(cold_dir):
+                st = e.stat(follow_symlinks=False)
+                if e.name in referenced:
+                    entry.cold_bytes += st.st_size
+                    entry.cold_files += 1
+                elif is_orphan(e.name, st, referenced, generating):
+                    orphans.append((project_id, Path(e.path), st, True))
+                    entry.orphan_bytes += st.st_size
+                    entry.orphan_files += 1
+        entry.total_bytes = (
+            entry.media_bytes + entry.cold_bytes + entry.derived_bytes + entry.project_file_bytes + entry.orphan_bytes
+        )
+        usage.append(entry)
+
+    # Cold folders of projects that no longer exist
+    if COLD_STORAGE_DIR is not None and COLD_STORAGE_DIR.is_dir():
+        for d in os.scandir(COLD_STORAGE_DIR):
+            if d.is_dir() and d.name not in refs:
+                for e in os.scandir(d.path):
+                    st = e.stat(follow_symlinks=False)
+                    if e.is_file() and now - st.st_mtime > ORPHAN_MIN_AGE:
+                        orphans.append((d.name, Path(e.path), st, True))
+    return usage, media_files, orphans
+
+def _orphan_model(project_id: str, path: Path, st: os.stat_result, cold: bool) -> OrphanFile:
+    base = COLD_STORAGE_DIR if cold else projects.PROJECTS_DIR
+    return OrphanFile(project_id=project_id, path=str(path.relative_to(base)), bytes=st.st_size, cold=cold)
+
+async def report() -> StorageReport:
+    """Disk usage per project plus the files no node references."""
+    refs = await _references()
+    usage, _, orphans = await asyncio.to_thread(_scan, refs)
+    usage.sort(key=lambda u: u.total_bytes, reverse=True)
+    return StorageReport(
+        projects=usage,
+        total_bytes=sum(u.total_bytes for u in usage),
+        orphans=[_orphan_model(*o) for o in orphans[:MAX_REPORTED_ORPHANS]],
+        orphan_files=len(orphans),
+        orphan_bytes=sum(o[2].st_size for o in orphans),
+        cold_storage_dir=str(COLD_STORAGE_DIR) if COLD_STORAGE_DIR else None,
+        last_run=LAST_RUN,
+    )
+
+def _already_recompressed(path: Path, st: os.stat_result) -> bool:
+    row = get_db().execute("SELECT size, mtime_ns FROM recompressed WHERE path = ?", (str(path),)).fetchone()
+    return row is not None and row["size"] == st.st_size and row["mtime_ns"] == st.st_mtime_ns
+
+async def _recompress(path: Path, st: os.stat_result, throttle: Throttle, run: StorageRun):
+    tmp = path.with_name(path.name + ".recompress.tmp")
+    # Read and written once each
+    await asyncio.sleep(throttle.delay(st.st_size * 2))
+    loop = asyncio.get_running_loop()
+    try:
+        try:
+            new_size = await loop.run_in_executor(media.get_pool(), _recompress_png, str(path), str(tmp))
+        except Exception as e:
+            print(f"Error recompressing {path}: {e}")
+            new_size = 0
+        # Skip files that changed while they were being recompressed
+        if new_size and new_size <= st.st_size * (1 - MIN_SAVING) and os.stat(path).st_mtime_ns == st.st_mtime_ns:
+            # Keep the timestamps, which the tiering policy goes by
+            shutil.copystat(path, tmp)
+            os.replace(tmp, path)
+            run.recompressed += 1
+            run.bytes_saved += st.st_size - new_size
+            metrics.STORAGE_ACTIONS.inc(action="recompress")
+            metrics.STORAGE_BYTES_RECLAIMED.inc(st.st_size - new_size, action="recompress")
+            st = os.stat(path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    get_db().execute(
+        "INSERT OR REPLACE INTO recompressed (path, size, mtime_ns) VALUES (?, ?, ?)",
+        (str(path), st.st_size, st.st_mtime_ns),
+    )
+
+async def _move_cold(project_id: str, path: Path, st: os.stat_result, throttle: Throttle, run: StorageRun):
+    dest = cold_path(project_id, path.name)
+    await asyncio.to_thread(_copy_paced, path, dest, throttle, is_busy)
+    # The copy is complete before the original goes, so locate() always finds one of them
+    path.unlink()
+    run.moved_cold += 1
+    run.bytes_moved += st.st_size
+    metrics.STORAGE_ACTIONS.inc(action="move_cold")
+    metrics.STORAGE_BYTES_RECLAIMED.inc(st.st_size, action="move_cold")
+
+async def run_pass() -> StorageRun:
+    """One storage pass: apply the recompression and tiering policies, then handle orphans.
+
+    Every file operation waits until no generation is running, and disk I/O is
+    paced to STORAGE_IO_BYTES_PER_SEC.
+    """
+    global LAST_RUN
+    run = StorageRun(started_at=datetime.now().isoformat())
+    LAST_RUN = run
+    throttle = Throttle(STORAGE_IO_BYTES_PER_SEC)
+    await _wait_idle(run)
+    refs = await _references()
+    _, media_files, orphans = await asyncio.to_thread(_scan, refs)
+    now = time.time()
+
+    recompress = RECOMPRESS_AFTER_DAYS > 0 and Image is not None
+    for project_id, path, st in media_files:
+        age_days = (now - st.st_mtime) / 86400
+        try:
+            if recompress and path.suffix.lower() == ".png" and age_days >= RECOMPRESS_AFTER_DAYS:
+                # Outputs hardlinked into the result cache would only be duplicated
+                if st.st_nlink == 1 and not _already_recompressed(path, st):
+                    await _wait_idle(run)
+                    await _recompress(path, st, throttle, run)
+                    st = os.stat(path)
+            if COLD_STORAGE_DIR is not None and age_days >= COLD_AFTER_DAYS:
+                await _wait_idle(run)
+                await _move_cold(project_id, path, st, throttle, run)
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            print(f"Storage manager failed on {path}: {e}")
+
+    if DELETE_ORPHANS:
+        for project_id, path, st, cold in orphans:
+            await _wait_idle(run)
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            run.orphans_deleted += 1
+            run.bytes_deleted += st.st_size
+            metrics.STORAGE_ACTIONS.inc(action="delete_orphan")
+            metrics.STORAGE_BYTES_RECLAIMED.inc(st.st_size, action="delete_orphan")
+
+    run.finished_at = datetime.now().isoformat()
+    return run
+
+def trigger():
+    """Starts a pass now instead of at the next interval."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+async def run_storage_manager(interval: float = None):
+    """Background task: runs a storage pass every interval, or when triggered."""
+    global _wakeup
+    interval = interval or STORAGE_INTERVAL
+    _wakeup = asyncio.Event()
+    _stopping.clear()
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+            try:
+                run = await run_pass()
+                print(
+                    f"Storage pass: recompressed {run.recompressed} (-{run.bytes_saved} bytes), "
+                    f"moved {run.moved_cold} to cold storage, deleted {run.orphans_deleted} orphans"
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Storage pass failed: {e}")
+    finally:
+        _stopping.set()
+        close()
@@ -1,6 +1,8 @@
 import json
 import os
+import re
 from pathlib import Path
+from typing import Dict
 from models import TemplateList
 
 PROJECTS_DIR = Path(__file__).parent.parent / "Projects"
@@ -22,3 +24,11 @@ def save_templates(templates: TemplateList):
     init_templates_file()
     with open(TEMPLATES_FILE, "w") as f:
         f.write(templates.model_dump_json(indent=2))
+
+def render_prompt(prompt_template: str, values: Dict[str, str]) -> str:
+    """Replaces {key} placeholders (case-insensitive) the same way the frontend does."""
+    prompt = prompt_template
+    for key, value in values.items():
+        if value:
+            prompt = re.sub(r"\{" + re.escape(key) + r"\}", lambda _: value, prompt, flags=re.IGNORECASE)
+    return prompt
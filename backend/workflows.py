@@ -1,18 +1,130 @@
 import json
 import os
 from pathlib import Path
-from models import WorkflowConfig, WorkflowConfigMap
+from typing import Dict, Any
+from models import WorkflowConfig, WorkflowConfigMap, GenerationParams
 
 WORKFLOWS_DIR = Path(__file__).parent.parent / "references" / "workflow"
 WORKFLOW_REGISTRY = {}
+# Precompiled templates, rebuilt together with the registry
+WORKFLOW_TEMPLATES: Dict[str, "WorkflowTemplate"] = {}
+# (filename, mtime_ns, size) of every workflow file the registry was built from
+_registry_signature = None
+
+class WorkflowTemplate:
+    """A workflow with its injection points resolved ahead of time.
+
+    build() returns a prompt graph that shares every untouched node with the
+    template and only copies the nodes it writes to.
+    """
+    def __init__(self, name: str, config: Dict[str, Any]):
+        self.name = name
+        self.data = config["data"]
+        self.map = config["map"]
+        m = self.map
+        data = self.data
+
+        def resolve(key):
+            node_id = m.get(key)
+            return node_id if node_id in data else None
+
+        self.sampler = resolve("sampler")
+        self.positive_prompt = resolve("positive_prompt")
+        self.negative_prompt = resolve("negative_prompt")
+        self.model = resolve("model")
+        self.model_field = m.get("model_field")
+        self.latent = resolve("latent")
+        self.save = m.get("save")
+        self.lora = resolve("lora")
+        self.lora_field = m.get("lora_field")
+
+        # For LoRA bypass: the LoraLoader's own inputs and every downstream input linked to it
+        self.lora_upstream = (None, None)
+        self.lora_refs = []
+        if self.lora:
+            lora_inputs = data[self.lora].get("inputs", {})
+            self.lora_upstream = (lora_inputs.get("model"), lora_inputs.get("clip"))
+            for n_id, n_data in data.items():
+                if n_id == self.lora: continue
+                for k, v in n_data.get("inputs", {}).items():
+                    if isinstance(v, list) and len(v) == 2 and v[0] == self.lora:
+                        self.lora_refs.append((n_id, k, v[1]))
+
+    def build(self, params: GenerationParams) -> Dict[str, Any]:
+        """Returns the ComfyUI prompt graph for params without modifying the template."""
+        workflow = dict(self.data)
+
+        def inputs_of(node_id):
+            # Copy-on-write: clone the node and its inputs the first time we touch it
+            node = workflow[node_id]
+            if node is self.data[node_id]:
+                node = dict(node)
+                node["inputs"] = dict(node.get("inputs", {}))
+                workflow[node_id] = node
+            return node["inputs"]
+
+        if self.sampler:
+            inputs = inputs_of(self.sampler)
+            inputs["seed"] = params.seed
+            inputs["steps"] = params.steps
+            inputs["cfg"] = params.cfg
+
+        if self.positive_prompt:
+            inputs_of(self.positive_prompt)["text"] = params.prompt
+
+        if self.negative_prompt:
+            inputs_of(self.negative_prompt)["text"] = params.negative_prompt
+
+        if self.model and params.model:
+            inputs_of(self.model)[self.model_field] = params.model
+
+        if self.lora:
+            if params.bypass_lora or not params.lora:
+                # Bypass: re-route downstream nodes to the LoraLoader's upstream model/clip
+                upstream_model, upstream_clip = self.lora_upstream
+                for n_id, k, output_idx in self.lora_refs:
+                    # Re-route based on the expected output type (0 for model, 1 for clip)
+                    if output_idx == 0 and upstream_model:
+                        inputs_of(n_id)[k] = upstream_model
+                    elif output_idx == 1 and upstream_clip:
+                        inputs_of(n_id)[k] = upstream_clip
+                # Remove the LoraLoader node from the workflow
+                del workflow[self.lora]
+            elif self.lora_field:
+                inputs_of(self.lora)[self.lora_field] = params.lora
+
+        if self.latent:
+            inputs = inputs_of(self.latent)
+            inputs["width"] = params.width
+            inputs["height"] = params.height
+
+        return workflow
 
 def init_workflows_dir():
     os.makedirs(WORKFLOWS_DIR, exist_ok=True)
 
+def _dir_signature():
+    sig = []
+    for file in sorted(os.listdir(WORKFLOWS_DIR)):
+        if not file.endswith(".json"): continue
+        st = os.stat(WORKFLOWS_DIR / file)
+        sig.append((file, st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+def _register(name: str, config: Dict[str, Any]):
+    WORKFLOW_REGISTRY[name] = config
+    try:
+        WORKFLOW_TEMPLATES[name] = WorkflowTemplate(name, config)
+    except Exception as e:
+        WORKFLOW_TEMPLATES.pop(name, None)
+        print("Error compiling workflow:", name, e)
+
 def load_workflows():
+    global _registry_signature
     init_workflows_dir()
     WORKFLOW_REGISTRY.clear()
-    
+    WORKFLOW_TEMPLATES.clear()
+
     # Load default hardcoded ones if files exist and we haven't created a central mapping for them
     # But for a robust system, let's keep maps locally in each file or we can just append map dynamically if not present.
     # To support user editing, let's look for any .json file in the workflows directory.
@@ -22,14 +134,14 @@ def load_workflows():
         if not file.endswith(".json"): continue
         path = WORKFLOWS_DIR / file
         name = file.replace(".json", "")
-        
+
         try:
             with open(path, "r", encoding="utf-8") as f:
                 content = json.load(f)
-            
+
             # Check if it's already wrapped in our format
             if "data" in content and "map" in content:
-                WORKFLOW_REGISTRY[name] = content
+                _register(name, content)
             else:
                 # Legacy raw format - add default empty map or hardcoded
                 default_map = {}
@@ -39,7 +151,7 @@ def load_workflows():
                     default_map = {"sampler": "3", "positive_prompt": "6", "negative_prompt": "7", "model": "16", "model_field": "unet_name", "latent": "13", "save": "9", "lora": "28", "lora_field": "lora_name"}
                 elif name == "i2v_wan22":
                     default_map = {"sampler": "85", "positive_prompt": "93", "negative_prompt": "89", "model": "95", "model_field": "unet_name", "latent": "98", "save": "108"}
-                
+
                 # Resave it wrapped
                 wrapped = {"data": content, "map": default_map}
                 try:
@@ -47,18 +159,36 @@ def load_workflows():
                         json.dump(wrapped, f, indent=2)
                 except Exception as ex:
                     print(f"Could not rewrite {file}", ex)
-                WORKFLOW_REGISTRY[name] = wrapped
+                _register(name, wrapped)
 
         except Exception as e:
             print("Error loading workflow:", file, e)
 
+    # Taken after loading so legacy rewrites above don't count as changes
+    _registry_signature = _dir_signature()
+
+def _ensure_loaded():
+    init_workflows_dir()
+    if _registry_signature is None or _dir_signature() != _registry_signature:
+        load_workflows()
+
 def get_workflows():
-    load_workflows()
+    _ensure_loaded()
     return WORKFLOW_REGISTRY
 
+def get_template(name: str) -> WorkflowTemplate:
+    _ensure_loaded()
+    return WORKFLOW_TEMPLATES.get(name)
+
+def get_templates():
+    _ensure_loaded()
+    return list(WORKFLOW_TEMPLATES.values())
+
 def save_workflow(name: str, config: WorkflowConfig):
-    init_workflows_dir()
+    global _registry_signature
+    _ensure_loaded()
     path = WORKFLOWS_DIR / f"{name}.json"
     with open(path, "w", encoding="utf-8") as f:
         f.write(config.model_dump_json(indent=2))
-    WORKFLOW_REGISTRY[name] = config.model_dump()
+    _register(name, config.model_dump())
+    _registry_signature = _dir_signature()
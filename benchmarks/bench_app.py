@@ -0,0 +1,270 @@
+"""Benchmarks the FastAPI app end to end against the simulated ComfyUI server.
+
+Measures:
+  - /api/generate throughput: submit latency and completed generations per second
+  - /api/projects/{id} latency (cold load and warm p50/p99) at several node counts,
+    and of the first page of /api/projects/{id}/nodes
+  - event-loop blocking: how late a 5 ms ticker fires while each phase runs
+
+The app runs in-process with every data directory redirected to a scratch
+folder; the fake ComfyUI server runs on its own thread and event loop so it
+doesn't count against the app's loop. Results are written as JSON so runs can
+be compared:
+
+    python benchmarks/bench_app.py --generations 100 --out results/$(git rev-parse --short HEAD).json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import httpx
+from fake_comfyui import FakeComfyUI, FakeConfig
+import projects
+import results
+import templates
+import comfyui
+import scheduler
+import main
+from models import GenerationNode, GenerationParams
+
+LAG_INTERVAL = 0.005
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+def summarize(seconds):
+    return {
+        "count": len(seconds),
+        "p50_ms": _ms(percentile(seconds, 50)),
+        "p99_ms": _ms(percentile(seconds, 99)),
+        "max_ms": _ms(max(seconds) if seconds else None),
+        "mean_ms": _ms(sum(seconds) / len(seconds) if seconds else None),
+    }
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+class LoopMonitor:
+    """Samples event-loop lag: how much later than scheduled a short sleep wakes up."""
+    def __init__(self, interval: float = LAG_INTERVAL):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - expected))
+
+    def __enter__(self):
+        self.lags = []
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+    def report(self):
+        # Lag above one tick means something held the loop for that long
+        blocked = [lag for lag in self.lags if lag > self.interval]
+        out = summarize(self.lags)
+        out["blocked_total_ms"] = _ms(sum(blocked))
+        out["blocked_samples"] = len(blocked)
+        return out
+
+def isolate(root: Path, server: str):
+    """Points every data file and the ComfyUI client at scratch locations."""
+    # The job, result, search and storage databases live under it too
+    projects.PROJECTS_DIR = root
+    templates.PROJECTS_DIR = root
+    templates.TEMPLATES_FILE = root / "templates.json"
+    # Every benchmark prompt is distinct, but don't let a cache hit skew throughput
+    results.RESULT_CACHE_MAX_BYTES = 0
+    comfyui.COMFYUI_SERVERS = [server]
+    comfyui.BACKENDS.clear()
+
+def make_params(seed: int, workflow: str) -> dict:
+    return {"workflow": workflow, "prompt": f"benchmark prompt {seed}", "seed": seed, "steps": 20}
+
+async def bench_generate(client, args):
+    project_ids = [projects.create_project(f"bench-generate-{i}").id for i in range(args.projects)]
+    submit = []
+    node_ids = []
+    with LoopMonitor() as monitor:
+        started = time.perf_counter()
+        for i in range(args.generations):
+            body = {"project_id": project_ids[i % len(project_ids)], "params": make_params(i, args.workflow)}
+            t0 = time.perf_counter()
+            r = await client.post("/api/generate", json=body)
+            submit.append(time.perf_counter() - t0)
+            r.raise_for_status()
+            node_ids.append((body["project_id"], r.json()["id"]))
+        submitted = time.perf_counter() - started
+
+        deadline = time.monotonic() + args.timeout
+        statuses = {}
+        while time.monotonic() < deadline:
+            statuses = {}
+            for project_id, node_id in node_ids:
+                status = projects.load_project(project_id).nodes[node_id].status
+                statuses[status] = statuses.get(status, 0) + 1
+            if not statuses.get("generating"):
+                break
+            await asyncio.sleep(0.02)
+        wall = time.perf_counter() - started
+
+    completed = statuses.get("completed", 0)
+    return {
+        "generations": args.generations,
+        "projects": args.projects,
+        "statuses": statuses,
+        "submit": summarize(submit),
+        "submit_seconds": round(submitted, 3),
+        "wall_seconds": round(wall, 3),
+        "completed_per_second": round(completed / wall, 3) if wall else None,
+        "event_loop": monitor.report(),
+    }
+
+def _synthetic_nodes(count: int, workflow: str):
+    nodes = []
+    parent = None
+    for i in range(count):
+        node = GenerationNode(
+            parent_id=parent,
+            params=GenerationParams(**make_params(i, workflow)),
+            image_filename=f"node{i}.png",
+        )
+        nodes.append(node)
+        # A mostly linear history with occasional branches, like real sessions
+        parent = node.id if random.random() > 0.1 else (nodes[random.randrange(len(nodes))].id)
+    return nodes
+
+async def bench_project_get(client, args, node_count: int):
+    p = projects.create_project(f"bench-get-{node_count}")
+    projects.add_nodes_to_project(p.id, _synthetic_nodes(node_count, args.workflow))
+    await projects.flush_dirty_projects()
+    await projects.compact_project(p.id)
+    url = f"/api/projects/{p.id}"
+
+    cold = []
+    for _ in range(args.cold_requests):
+        projects.PROJECT_CACHE.pop(p.id, None)
+        t0 = time.perf_counter()
+        r = await client.get(url)
+        cold.append(time.perf_counter() - t0)
+        r.raise_for_status()
+
+    warm = []
+    size = 0
+    with LoopMonitor() as monitor:
+        for _ in range(args.requests):
+            t0 = time.perf_counter()
+            r = await client.get(url)
+            warm.append(time.perf_counter() - t0)
+            size = len(r.content)
+            # In-process requests never wait on a socket; yield so the ticker sees how long each one held the loop
+            await asyncio.sleep(0)
+    first_page = []
+    for _ in range(args.requests):
+        t0 = time.perf_counter()
+        r = await client.get(f"{url}/nodes", params={"limit": 100})
+        first_page.append(time.perf_counter() - t0)
+        r.raise_for_status()
+    return {
+        "nodes": node_count,
+        "response_bytes": size,
+        "cold": summarize(cold),
+        "warm": summarize(warm),
+        "first_page_of_100": summarize(first_page),
+        "event_loop": monitor.report(),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+async def run(args):
+    fake = FakeComfyUI(FakeConfig(
+        latency=args.latency, steps=args.steps, step_time=args.step_time,
+        output_bytes=args.output_kb * 1024, workers=args.workers,
+    ))
+    server = fake.start_in_thread()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            isolate(Path(tmp), server)
+            if args.max_in_flight:
+                scheduler.MAX_IN_FLIGHT = args.max_in_flight
+                scheduler.MAX_IN_FLIGHT_PER_PROJECT = args.max_in_flight
+            async with main.lifespan(main.app):
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                    generate = await bench_generate(client, args) if args.generations else None
+                    project_get = [await bench_project_get(client, args, n) for n in args.node_counts]
+    finally:
+        fake.stop()
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "fake_prompts_received": fake.prompts_received,
+        "generate": generate,
+        "project_get": project_get,
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the ComfyStudio backend")
+    parser.add_argument("--generations", type=int, default=50, help="Generations to submit (0 skips the phase)")
+    parser.add_argument("--projects", type=int, default=2, help="Projects the generations are spread over")
+    parser.add_argument("--workflow", default="t2i_sdxl")
+    parser.add_argument("--max-in-flight", type=int, default=0, help="Override the scheduler's in-flight limits")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for generations to finish")
+    parser.add_argument("--node-counts", type=lambda s: [int(n) for n in s.split(",")], default=[10, 1000, 10000])
+    parser.add_argument("--requests", type=int, default=200, help="Warm GETs per project size")
+    parser.add_argument("--cold-requests", type=int, default=3, help="GETs after evicting the project from memory")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake ComfyUI HTTP latency in seconds")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--step-time", type=float, default=0.005)
+    parser.add_argument("--output-kb", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=2, help="Prompts the fake executes concurrently")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic project shapes")
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    results_json = json.dumps(asyncio.run(run(args)), indent=2)
+    print(results_json)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            f.write(results_json)
+
+if __name__ == "__main__":
+    main_cli()
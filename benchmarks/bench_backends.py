@@ -0,0 +1,177 @@
+"""Benchmarks dispatch over a pool of ComfyUI backends.
+
+Starts several simulated ComfyUI servers plus the address of one that isn't
+running, points COMFYUI_SERVERS at all of them and measures:
+
+  - dispatch: a batch in one project, one model; how the prompts spread over
+    the backends (least queue depth) and the wall time
+  - affinity: generations alternating between two models, with model affinity
+    on and off; how many model loads the backends performed and the wall time
+  - failover: queue_prompt while the dead backend is first in line and still
+    looks healthy; how long it takes to land on a live one
+
+Exits non-zero if a live backend got no work, a generation failed, affinity
+didn't save model loads, or failover waited out the retry backoff:
+
+    python benchmarks/bench_backends.py --backends 3 --out backends.json
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_app import isolate, make_params, summarize, git_revision
+from fake_comfyui import FakeComfyUI, FakeConfig, free_port
+import httpx
+import projects
+import comfyui
+import workflows
+import main
+from models import GenerationParams
+
+MODELS = ["sd_xl_base_1.0.safetensors", "juggernautXL.safetensors"]
+
+async def generate(client, project_id: str, params: list, timeout: float):
+    """Submits generations and waits until none is generating. Returns (statuses, wall seconds)."""
+    started = time.perf_counter()
+    node_ids = []
+    for body in params:
+        r = await client.post("/api/generate", json={"project_id": project_id, "params": body})
+        r.raise_for_status()
+        node_ids.append(r.json()["id"])
+    deadline = time.monotonic() + timeout
+    while True:
+        statuses = {}
+        for node_id in node_ids:
+            status = projects.get_node(project_id, node_id).status
+            statuses[status] = statuses.get(status, 0) + 1
+        if not statuses.get("generating") or time.monotonic() > deadline:
+            return statuses, time.perf_counter() - started
+        await asyncio.sleep(0.02)
+
+def reset(fakes):
+    for b in comfyui.get_backends():
+        b.last_model = None
+    for fake in fakes:
+        fake.loaded_model = None
+
+async def bench_dispatch(client, fakes, args):
+    reset(fakes)
+    before = [f.prompts_received for f in fakes]
+    project_id = projects.create_project("bench-dispatch").id
+    params = [dict(make_params(i, "t2i_sdxl"), model=MODELS[0]) for i in range(args.generations)]
+    statuses, wall = await generate(client, project_id, params, args.timeout)
+    per_backend = [f.prompts_received - b for f, b in zip(fakes, before)]
+    return {
+        "generations": args.generations,
+        "statuses": statuses,
+        "prompts_per_backend": per_backend,
+        "wall_seconds": round(wall, 3),
+    }
+
+async def bench_affinity(client, fakes, args, affinity: bool):
+    reset(fakes)
+    comfyui.AFFINITY_MAX_EXTRA_DEPTH = args.affinity_depth if affinity else -1
+    before = [f.model_loads for f in fakes]
+    project_id = projects.create_project(f"bench-affinity-{affinity}").id
+    params = [dict(make_params(i, "t2i_sdxl"), model=MODELS[i % len(MODELS)]) for i in range(args.generations)]
+    statuses, wall = await generate(client, project_id, params, args.timeout)
+    return {
+        "affinity": affinity,
+        "statuses": statuses,
+        "model_loads": sum(f.model_loads - b for f, b in zip(fakes, before)),
+        "wall_seconds": round(wall, 3),
+    }
+
+async def bench_failover(dead: str, args):
+    dead_backend = comfyui.BACKENDS[dead]
+    prompt = workflows.get_template("t2i_sdxl").build(GenerationParams(**make_params(0, "t2i_sdxl")))
+    timings = []
+    servers = set()
+    for _ in range(args.failover_requests):
+        # As if the health check hadn't noticed yet, and it looked idle
+        dead_backend.healthy = True
+        dead_backend.queue_depth = -1
+        t0 = time.perf_counter()
+        prompt_id, server = await comfyui.queue_prompt(prompt)
+        timings.append(time.perf_counter() - t0)
+        servers.add(server if prompt_id else None)
+    return {"requests": args.failover_requests, "servers": sorted(map(str, servers)), **summarize(timings)}
+
+async def run(args):
+    config = FakeConfig(steps=args.steps, step_time=args.step_time, output_bytes=args.output_kb * 1024,
+                        model_load_time=args.model_load_time)
+    fakes = [FakeComfyUI(config) for _ in range(args.backends)]
+    servers = [f.start_in_thread() for f in fakes]
+    # Nothing listens here: connections are refused
+    dead = f"127.0.0.1:{free_port()}"
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            isolate(Path(tmp), servers[0])
+            comfyui.COMFYUI_SERVERS = [dead] + servers
+            comfyui.BACKENDS.clear()
+            async with main.lifespan(main.app):
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                    dispatch = await bench_dispatch(client, fakes, args)
+                    affinity = [await bench_affinity(client, fakes, args, on) for on in (True, False)]
+                    failover = await bench_failover(dead, args)
+    finally:
+        for f in fakes:
+            f.stop()
+
+    problems = []
+    for phase in [dispatch] + affinity:
+        if set(phase["statuses"]) != {"completed"}:
+            problems.append(f"generations ended as {phase['statuses']}")
+    if 0 in dispatch["prompts_per_backend"]:
+        problems.append(f"a live backend got no work: {dispatch['prompts_per_backend']}")
+    if affinity[0]["model_loads"] >= affinity[1]["model_loads"]:
+        problems.append(f"affinity saved no model loads: {affinity[0]['model_loads']} vs {affinity[1]['model_loads']}")
+    if dead in failover["servers"] or "None" in failover["servers"]:
+        problems.append(f"failover landed on {failover['servers']}")
+    if failover["max_ms"] >= comfyui.HTTP_BACKOFF * 1000:
+        problems.append(f"failover took {failover['max_ms']} ms, as long as a retry backoff")
+    return {
+        "revision": git_revision(),
+        "backends": args.backends,
+        "dead_backend": dead,
+        "dispatch": dispatch,
+        "affinity": affinity,
+        "failover": failover,
+        "problems": problems,
+        "ok": not problems,
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Multi-backend dispatch benchmark")
+    parser.add_argument("--backends", type=int, default=3, help="Live fake ComfyUI servers; one dead one is added")
+    parser.add_argument("--generations", type=int, default=12, help="Generations per phase")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--step-time", type=float, default=0.02)
+    parser.add_argument("--model-load-time", type=float, default=0.3, help="Seconds a fake takes to switch models")
+    parser.add_argument("--affinity-depth", type=int, default=comfyui.AFFINITY_MAX_EXTRA_DEPTH)
+    parser.add_argument("--output-kb", type=int, default=64)
+    parser.add_argument("--failover-requests", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    sys.exit(0 if report["ok"] else 1)
+
+if __name__ == "__main__":
+    main_cli()
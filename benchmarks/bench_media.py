@@ -0,0 +1,108 @@
+"""Measures what conditional requests save when a gallery is reloaded.
+
+Fills a scratch project with generated outputs, fetches every one of them the
+way the timeline does on first load, then reloads the gallery twice: once
+without validators (what a browser does when nothing is cached) and once with
+If-None-Match from the first load. Also checks that byte-range requests on a
+video return 206 with the right slice.
+
+    python benchmarks/bench_media.py --images 200 --image-kb 1500 --out media.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import httpx
+import projects
+import main
+
+PROJECT_ID = "bench-media"
+
+def make_project(root: Path, images: int, image_kb: int, video_kb: int):
+    projects.PROJECTS_DIR = root
+    p_dir = projects.get_project_dir(PROJECT_ID)
+    os.makedirs(p_dir, exist_ok=True)
+    names = []
+    for i in range(images):
+        name = f"node{i:05d}.png"
+        (p_dir / name).write_bytes(os.urandom(image_kb * 1024))
+        names.append(name)
+    video = "clip.mp4"
+    (p_dir / video).write_bytes(os.urandom(video_kb * 1024))
+    return names, video
+
+async def load_gallery(client, names, etags=None, record=None):
+    """Fetches every image; sends If-None-Match from etags, stores response ETags in record."""
+    sent = 0
+    statuses = {}
+    started = time.perf_counter()
+    for name in names:
+        headers = {"If-None-Match": etags[name]} if etags else {}
+        r = await client.get(f"/api/projects/{PROJECT_ID}/images/{name}", headers=headers)
+        sent += len(r.content)
+        statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+        if record is not None:
+            record[name] = r.headers["etag"]
+    return {"bytes": sent, "seconds": time.perf_counter() - started, "statuses": statuses}
+
+async def check_ranges(client, video):
+    url = f"/api/projects/{PROJECT_ID}/images/{video}"
+    full = (await client.get(url)).content
+    r = await client.get(url, headers={"Range": "bytes=1000-1999"})
+    tail = await client.get(url, headers={"Range": "bytes=-500"})
+    return {
+        "status": r.status_code,
+        "content_range": r.headers.get("content-range"),
+        "slice_ok": r.content == full[1000:2000],
+        "suffix_ok": tail.status_code == 206 and tail.content == full[-500:],
+        "accept_ranges": r.headers.get("accept-ranges"),
+    }
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        names, video = make_project(Path(tmp), args.images, args.image_kb, args.video_kb)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            etags = {}
+            first = await load_gallery(client, names, record=etags)
+            cold = await load_gallery(client, names)
+            warm = await load_gallery(client, names, etags)
+            ranges = await check_ranges(client, video)
+
+    saved = cold["bytes"] - warm["bytes"]
+    return {
+        "images": args.images,
+        "image_kb": args.image_kb,
+        "first_load": first,
+        "reload_unconditional": cold,
+        "reload_conditional": warm,
+        "bytes_saved": saved,
+        "saved_ratio": saved / cold["bytes"] if cold["bytes"] else 0.0,
+        "ranges": ranges,
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--image-kb", type=int, default=1024)
+    parser.add_argument("--video-kb", type=int, default=4096)
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,143 @@
+"""Benchmarks /api/search over a large synthetic node history.
+
+Spreads N nodes (default 100k) over several projects, lets the incremental
+indexer pick them up, then measures query latency (p50/p99) for typical
+searches: a single word, several word prefixes, filters only, and words plus
+filters. For comparison it also times the scan the index replaces: reading
+every project and matching each node's params in Python.
+
+    python benchmarks/bench_search.py --nodes 100000 --out search.json
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_app import isolate, summarize, git_revision
+import httpx
+import projects
+import search
+import main
+from models import GenerationNode, GenerationParams
+
+SUBJECTS = ["fox", "castle", "portrait", "robot", "forest", "harbor", "dragon", "city", "garden", "astronaut"]
+STYLES = ["watercolor", "oil painting", "photograph", "pixel art", "ink sketch", "cinematic", "anime"]
+MODELS = ["sd_xl_base_1.0.safetensors", "juggernautXL.safetensors", "z_image_turbo.safetensors"]
+LORAS = ["", "detail_tweaker.safetensors", "film_grain.safetensors"]
+WORKFLOWS = ["t2i_sdxl", "t2i_zimage"]
+
+QUERIES = {
+    "word": {"q": "dragon"},
+    "prefixes": {"q": "wat cast"},
+    "filters": {"model": MODELS[1], "lora": LORAS[2]},
+    "word_and_filters": {"q": "portrait", "workflow": WORKFLOWS[1]},
+    "seed": {"seed": 4242},
+}
+
+def synthetic_node(i: int) -> GenerationNode:
+    subject = random.choice(SUBJECTS)
+    style = random.choice(STYLES)
+    return GenerationNode(params=GenerationParams(
+        workflow=random.choice(WORKFLOWS),
+        prompt=f"a {random.choice(['small', 'huge', 'ancient', 'neon'])} {subject}, {style}, detailed {i}",
+        negative_prompt="blurry, lowres",
+        template_values={"subject": subject, "style": style},
+        model=random.choice(MODELS),
+        lora=random.choice(LORAS),
+        seed=i,
+    ))
+
+def scan(params: dict):
+    """The alternative to the index: load every project and test every node."""
+    words = params.get("q", "").lower().split()
+    hits = 0
+    for summary in projects.get_project_summaries():
+        p = projects.peek_project(summary.id)
+        for node in p.nodes.values():
+            prm = node.params
+            if params.get("model") and prm.model != params["model"]:
+                continue
+            if params.get("lora") and prm.lora != params["lora"]:
+                continue
+            if params.get("workflow") and prm.workflow != params["workflow"]:
+                continue
+            if params.get("seed") is not None and prm.seed != params["seed"]:
+                continue
+            text = " ".join([prm.prompt, prm.negative_prompt, prm.model, prm.lora or "", prm.workflow,
+                             " ".join((prm.template_values or {}).values())]).lower()
+            if all(w in text for w in words):
+                hits += 1
+    return hits
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        isolate(Path(tmp), "127.0.0.1:1")
+        async with main.lifespan(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+                project_ids = [projects.create_project(f"bench-search-{i}").id for i in range(args.projects)]
+                per_project = args.nodes // len(project_ids)
+                started = time.perf_counter()
+                for n, project_id in enumerate(project_ids):
+                    base = n * per_project
+                    projects.add_nodes_to_project(project_id, [synthetic_node(base + i) for i in range(per_project)])
+                    await search.flush()
+                index_seconds = time.perf_counter() - started
+                await projects.flush_dirty_projects()
+                # Settle the project files so a background compaction doesn't land mid-measurement
+                for project_id in project_ids:
+                    await projects.compact_project(project_id)
+
+                queries = {}
+                for name, params in QUERIES.items():
+                    timings = []
+                    total = 0
+                    for _ in range(args.requests):
+                        t0 = time.perf_counter()
+                        r = await client.get("/api/search", params=params)
+                        timings.append(time.perf_counter() - t0)
+                        r.raise_for_status()
+                        total = r.json()["total"]
+                    queries[name] = {"params": params, "total": total, **summarize(timings)}
+
+                # Scan baseline, with projects read from disk like a cold server would
+                projects.PROJECT_CACHE.clear()
+                scans = {}
+                for name, params in QUERIES.items():
+                    t0 = time.perf_counter()
+                    hits = await asyncio.to_thread(scan, params)
+                    scans[name] = {"total": hits, "ms": round((time.perf_counter() - t0) * 1000, 3)}
+
+    return {
+        "revision": git_revision(),
+        "nodes": per_project * len(project_ids),
+        "projects": len(project_ids),
+        "index_seconds": round(index_seconds, 3),
+        "queries": queries,
+        "scan": scans,
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Search index benchmark")
+    parser.add_argument("--nodes", type=int, default=100_000)
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per query")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    text = json.dumps(asyncio.run(run(args)), indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+
+if __name__ == "__main__":
+    main_cli()
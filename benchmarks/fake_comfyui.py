@@ -0,0 +1,350 @@
+"""A simulated ComfyUI server for benchmarks and load tests.
+
+Implements the parts of the ComfyUI API the backend talks to: /prompt, /ws,
+/history, /view, /object_info, /queue and /interrupt. Prompts "sample" for a
+configurable number of steps, reporting progress (and optionally preview
+frames) over the websocket, and every output is a PNG of a configurable size.
+
+Run it standalone and point the backend at it:
+
+    python benchmarks/fake_comfyui.py --port 8190 --steps 20 --step-time 0.05
+    COMFYUI_SERVERS=127.0.0.1:8190 python backend/main.py
+
+or start it in-process with FakeComfyUI(config).start_in_thread().
+"""
+import os
+import json
+import time
+import uuid
+import zlib
+import struct
+import socket
+import asyncio
+import argparse
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+DEFAULT_MODELS = {
+    "CheckpointLoaderSimple": {"ckpt_name": ["sd_xl_base_1.0.safetensors", "juggernautXL.safetensors"]},
+    "UNETLoader": {"unet_name": ["z_image_turbo.safetensors"]},
+    "UnetLoaderGGUF": {"unet_name": ["wan2.2_i2v_Q4.gguf"]},
+    "LoraLoader": {"lora_name": ["detail_tweaker.safetensors", "film_grain.safetensors"]},
+}
+
+@dataclass
+class FakeConfig:
+    # Added to every HTTP response, in seconds
+    latency: float = 0.0
+    steps: int = 20
+    # Seconds per sampling step
+    step_time: float = 0.01
+    # Approximate size of every output PNG in bytes
+    output_bytes: int = 256 * 1024
+    # Prompts executed at the same time, like that many GPUs behind one server
+    workers: int = 1
+    # Send a binary preview frame every N steps; 0 disables previews
+    preview_every: int = 0
+    # Seconds to "load" a checkpoint when a prompt needs another model than the previous one
+    model_load_time: float = 0.0
+    models: Dict[str, Dict[str, List[str]]] = field(default_factory=lambda: DEFAULT_MODELS)
+
+def make_png(num_bytes: int) -> bytes:
+    """A valid RGB PNG of roughly num_bytes, filled with incompressible noise."""
+    side = max(1, int((num_bytes / 3) ** 0.5))
+    raw = b"".join(b"\x00" + os.urandom(side * 3) for _ in range(side))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 1))
+        + chunk(b"IEND", b"")
+    )
+
+def prompt_model(prompt: dict) -> Optional[str]:
+    """The checkpoint a prompt loads, from its first loader node."""
+    for node in prompt.values():
+        inputs = node.get("inputs", {}) if isinstance(node, dict) else {}
+        for name in ("ckpt_name", "unet_name"):
+            if isinstance(inputs.get(name), str):
+                return inputs[name]
+    return None
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class FakeComfyUI:
+    def __init__(self, config: FakeConfig = None):
+        self.config = config or FakeConfig()
+        self.output = make_png(self.config.output_bytes)
+        # A tiny JPEG-tagged payload; the backend only forwards the bytes
+        self.preview = struct.pack(">II", 1, 1) + b"\xff\xd8fake-preview\xff\xd9"
+        self.clients: Dict[str, Set[WebSocket]] = {}
+        # prompt_id -> (number, prompt)
+        self.pending: "OrderedDict[str, tuple]" = OrderedDict()
+        self.running: Dict[str, tuple] = {}
+        self.owners: Dict[str, str] = {}
+        self.history: Dict[str, dict] = {}
+        self.interrupted: Set[str] = set()
+        # Websocket connections are refused until this time.monotonic() value
+        self.refuse_ws_until = 0.0
+        self.prompts_received = 0
+        self.loaded_model: Optional[str] = None
+        self.model_loads = 0
+        self._number = 0
+        self._queue: asyncio.Queue = None
+        self._loop: asyncio.AbstractEventLoop = None
+        self._server: uvicorn.Server = None
+        self._thread: threading.Thread = None
+        self.app = Starlette(
+            routes=[
+                Route("/prompt", self.post_prompt, methods=["POST"]),
+                Route("/history/{prompt_id}", self.get_history),
+                Route("/history", self.get_all_history),
+                Route("/view", self.view),
+                Route("/object_info", self.object_info),
+                Route("/object_info/{node_class}", self.object_info),
+                Route("/queue", self.get_queue),
+                Route("/queue", self.post_queue, methods=["POST"]),
+                Route("/interrupt", self.post_interrupt, methods=["POST"]),
+                WebSocketRoute("/ws", self.ws),
+            ],
+            lifespan=self._lifespan,
+        )
+
+    @asynccontextmanager
+    async def _lifespan(self, app):
+        self._queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.config.workers)]
+        yield
+        for w in workers:
+            w.cancel()
+
+    async def _delay(self):
+        if self.config.latency:
+            await asyncio.sleep(self.config.latency)
+
+    async def _send(self, client_id: str, message):
+        for ws in list(self.clients.get(client_id, ())):
+            try:
+                if isinstance(message, bytes):
+                    await ws.send_bytes(message)
+                else:
+                    await ws.send_text(json.dumps(message))
+            except Exception:
+                self.clients.get(client_id, set()).discard(ws)
+
+    async def _broadcast_status(self):
+        status = {"type": "status", "data": {"status": {"exec_info": {"queue_remaining": len(self.pending) + len(self.running)}}}}
+        for client_id in list(self.clients):
+            await self._send(client_id, status)
+
+    async def _worker(self):
+        while True:
+            prompt_id = await self._queue.get()
+            entry = self.pending.pop(prompt_id, None)
+            if entry is None:
+                # Deleted from the queue before it started
+                continue
+            self.running[prompt_id] = entry
+            try:
+                await self._execute(prompt_id, entry[1])
+            finally:
+                self.running.pop(prompt_id, None)
+                self.interrupted.discard(prompt_id)
+                await self._broadcast_status()
+
+    async def _execute(self, prompt_id: str, prompt: dict):
+        client_id = self.owners.get(prompt_id, "")
+        node_ids = list(prompt)
+        first = node_ids[0] if node_ids else "1"
+        await self._send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+        await self._send(client_id, {"type": "executing", "data": {"node": first, "prompt_id": prompt_id}})
+        model = prompt_model(prompt)
+        if model and model != self.loaded_model:
+            self.loaded_model = model
+            self.model_loads += 1
+            await asyncio.sleep(self.config.model_load_time)
+        for step in range(1, self.config.steps + 1):
+            await asyncio.sleep(self.config.step_time)
+            if prompt_id in self.interrupted:
+                await self._send(client_id, {"type": "execution_interrupted", "data": {"prompt_id": prompt_id}})
+                return
+            await self._send(client_id, {
+                "type": "progress",
+                "data": {"value": step, "max": self.config.steps, "prompt_id": prompt_id, "node": first},
+            })
+            if self.config.preview_every and step % self.config.preview_every == 0:
+                await self._send(client_id, self.preview)
+        image = {"filename": f"{prompt_id}.png", "subfolder": "", "type": "output"}
+        # Every node reports the output so any workflow's save node finds it
+        outputs = {node_id: {"images": [image]} for node_id in node_ids}
+        self.history[prompt_id] = {
+            "prompt": [0, prompt_id, prompt, {}, node_ids],
+            "outputs": outputs,
+            "status": {"status_str": "success", "completed": True},
+        }
+        await self._send(client_id, {"type": "executed", "data": {"node": first, "prompt_id": prompt_id, "output": outputs.get(first)}})
+        await self._send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+    async def post_prompt(self, request: Request):
+        await self._delay()
+        body = await request.json()
+        prompt = body.get("prompt")
+        if not isinstance(prompt, dict):
+            return JSONResponse({"error": "invalid prompt"}, status_code=400)
+        prompt_id = str(uuid.uuid4())
+        self._number += 1
+        self.prompts_received += 1
+        self.owners[prompt_id] = body.get("client_id", "")
+        self.pending[prompt_id] = (self._number, prompt)
+        self._queue.put_nowait(prompt_id)
+        await self._broadcast_status()
+        return JSONResponse({"prompt_id": prompt_id, "number": self._number, "node_errors": {}})
+
+    async def get_history(self, request: Request):
+        await self._delay()
+        prompt_id = request.path_params["prompt_id"]
+        entry = self.history.get(prompt_id)
+        return JSONResponse({prompt_id: entry} if entry else {})
+
+    async def get_all_history(self, request: Request):
+        await self._delay()
+        return JSONResponse(self.history)
+
+    async def view(self, request: Request):
+        await self._delay()
+        return Response(self.output, media_type="image/png")
+
+    async def object_info(self, request: Request):
+        await self._delay()
+        node_class = request.path_params.get("node_class")
+        info = {
+            cls: {"input": {"required": {name: [choices] for name, choices in fields.items()}}}
+            for cls, fields in self.config.models.items()
+        }
+        if node_class:
+            return JSONResponse({node_class: info[node_class]} if node_class in info else {})
+        return JSONResponse(info)
+
+    def _queue_entries(self, entries):
+        return [[number, prompt_id, {}, {}, []] for prompt_id, (number, _) in entries.items()]
+
+    async def get_queue(self, request: Request):
+        await self._delay()
+        return JSONResponse({
+            "queue_running": self._queue_entries(self.running),
+            "queue_pending": self._queue_entries(self.pending),
+        })
+
+    async def post_queue(self, request: Request):
+        await self._delay()
+        body = await request.json()
+        if body.get("clear"):
+            self.pending.clear()
+        for prompt_id in body.get("delete", []):
+            self.pending.pop(prompt_id, None)
+        await self._broadcast_status()
+        return Response(status_code=200)
+
+    async def post_interrupt(self, request: Request):
+        await self._delay()
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        prompt_id = body.get("prompt_id")
+        self.interrupted.update([prompt_id] if prompt_id else list(self.running))
+        return Response(status_code=200)
+
+    async def ws(self, websocket: WebSocket):
+        client_id = websocket.query_params.get("clientId") or str(uuid.uuid4())
+        if time.monotonic() < self.refuse_ws_until:
+            await websocket.close()
+            return
+        await websocket.accept()
+        self.clients.setdefault(client_id, set()).add(websocket)
+        await websocket.send_text(json.dumps({
+            "type": "status",
+            "data": {"status": {"exec_info": {"queue_remaining": len(self.pending) + len(self.running)}}, "sid": client_id},
+        }))
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.clients.get(client_id, set()).discard(websocket)
+
+    async def _close_websockets(self):
+        for sockets in list(self.clients.values()):
+            for ws in list(sockets):
+                try:
+                    await ws.close()
+                except Exception:
+                    pass
+
+    def drop_websockets(self, seconds: float = 0.0):
+        """Closes every websocket and refuses new ones for a while; prompts keep running.
+
+        Thread-safe, for use while the fake is served by start_in_thread.
+        """
+        self.refuse_ws_until = time.monotonic() + seconds
+        asyncio.run_coroutine_threadsafe(self._close_websockets(), self._loop).result(timeout=5)
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = None) -> str:
+        """Serves the fake on its own event loop in a daemon thread and returns its host:port."""
+        port = port or free_port()
+        config = uvicorn.Config(self.app, host=host, port=port, log_level="warning", lifespan="on")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("Fake ComfyUI server did not start")
+            time.sleep(0.01)
+        return f"{host}:{port}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+            self._server = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated ComfyUI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8190)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every HTTP response")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--step-time", type=float, default=0.05, help="Seconds per sampling step")
+    parser.add_argument("--output-kb", type=int, default=256, help="Approximate size of each output PNG")
+    parser.add_argument("--workers", type=int, default=1, help="Prompts executed concurrently")
+    parser.add_argument("--preview-every", type=int, default=0, help="Send a preview frame every N steps")
+    parser.add_argument("--model-load-time", type=float, default=0.0, help="Seconds to switch to another model")
+    args = parser.parse_args()
+    fake = FakeComfyUI(FakeConfig(
+        latency=args.latency, steps=args.steps, step_time=args.step_time,
+        output_bytes=args.output_kb * 1024, workers=args.workers, preview_every=args.preview_every,
+        model_load_time=args.model_load_time,
+    ))
+    uvicorn.run(fake.app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
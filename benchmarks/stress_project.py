@@ -0,0 +1,218 @@
+"""Stress test: many concurrent generations in one project must not lose updates.
+
+Submits N generations (default 100) to a single project with every one of
+them allowed in flight at once, against the simulated ComfyUI server with
+progress and preview frames on. Journal compaction is forced to run
+constantly, readers hammer the project and its node pages throughout, and a
+few jobs are cancelled mid-run. Afterwards it checks, in memory and after
+reloading the project from disk, that:
+
+  - every node exists exactly once and reached a terminal status
+  - completed nodes have their output file, cancelled ones stay cancelled
+  - node revisions are unique and the project revision covers them all
+
+Then it serves the app with uvicorn, holds an event stream open and shuts the
+server down the way Ctrl+C does; the server must exit within its graceful
+shutdown timeout and a generation submitted just before must be on disk.
+
+Exits non-zero on any violation and prints a JSON report:
+
+    python benchmarks/stress_project.py --generations 100 --out stress.json
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_app import isolate, make_params
+from fake_comfyui import FakeComfyUI, FakeConfig, free_port
+import httpx
+import uvicorn
+import projects
+import scheduler
+import main
+
+async def readers(client, project_id, stop: asyncio.Event, errors: list):
+    reads = 0
+    while not stop.is_set():
+        r = await client.get(f"/api/projects/{project_id}")
+        page = await client.get(f"/api/projects/{project_id}/nodes", params={"limit": 20})
+        if r.status_code != 200 or page.status_code != 200:
+            errors.append(f"read failed: {r.status_code}/{page.status_code}")
+        reads += 2
+        await asyncio.sleep(0.005)
+    return reads
+
+def check(p, node_ids, cancelled, where):
+    problems = []
+    if len(p.nodes) != len(node_ids):
+        problems.append(f"{where}: expected {len(node_ids)} nodes, found {len(p.nodes)}")
+    revisions = set()
+    for node_id in node_ids:
+        node = p.nodes.get(node_id)
+        if node is None:
+            problems.append(f"{where}: node {node_id} missing")
+            continue
+        if node.revision in revisions:
+            problems.append(f"{where}: duplicate revision {node.revision}")
+        revisions.add(node.revision)
+        if node.revision > p.revision:
+            problems.append(f"{where}: node {node_id} revision {node.revision} > project {p.revision}")
+        if node_id in cancelled:
+            if node.status != "error" or node.error != "Cancelled.":
+                problems.append(f"{where}: cancelled node {node_id} ended as {node.status}")
+        elif node.status != "completed":
+            problems.append(f"{where}: node {node_id} ended as {node.status} ({node.error})")
+        elif not (projects.get_project_dir(p.id) / node.image_filename).exists():
+            problems.append(f"{where}: output of {node_id} missing")
+        elif node.progress != 1.0:
+            problems.append(f"{where}: completed node {node_id} has progress {node.progress}")
+    return problems
+
+async def check_shutdown(args):
+    """Shuts a uvicorn server down while an event stream is attached."""
+    port = free_port()
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning",
+                            timeout_graceful_shutdown=main.SHUTDOWN_TIMEOUT)
+    server = main.Server(config)
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            return {"problems": [f"server failed to start: {serving.exception()}"]}
+        await asyncio.sleep(0.01)
+
+    problems = []
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout) as client:
+        project_id = (await client.post("/api/projects", json={"name": "shutdown"})).json()["id"]
+        async with client.stream("GET", f"/api/projects/{project_id}/events") as events:
+            lines = events.aiter_lines()
+            await lines.__anext__()
+            # Still only in memory: the write-behind flush is seconds away
+            r = await client.post("/api/generate", json={"project_id": project_id, "params": make_params(0, "t2i_sdxl")})
+            node_id = r.json()["id"]
+
+            started = time.perf_counter()
+            # What uvicorn's SIGINT/SIGTERM handler does
+            server.should_exit = True
+            try:
+                async for _ in lines:
+                    pass
+            except httpx.HTTPError as e:
+                problems.append(f"event stream broke instead of ending: {e!r}")
+            await serving
+            elapsed = time.perf_counter() - started
+
+    if elapsed >= main.SHUTDOWN_TIMEOUT:
+        problems.append(f"shutdown took {elapsed:.1f} s, waiting out the graceful timeout")
+    projects.PROJECT_CACHE.clear()
+    projects.NODE_INDEXES.clear()
+    if node_id not in projects.load_project(project_id).nodes:
+        problems.append(f"node {node_id} submitted before shutdown is not on disk")
+    return {"seconds": round(elapsed, 3), "problems": problems}
+
+async def run(args):
+    fake = FakeComfyUI(FakeConfig(
+        steps=args.steps, step_time=args.step_time, output_bytes=args.output_kb * 1024,
+        workers=args.workers, preview_every=1,
+    ))
+    server = fake.start_in_thread()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            isolate(Path(tmp), server)
+            scheduler.MAX_IN_FLIGHT = args.generations
+            scheduler.MAX_IN_FLIGHT_PER_PROJECT = args.generations
+            # Compact on nearly every flush, and flush often
+            projects.JOURNAL_COMPACT_BYTES = 1
+            async with main.lifespan(main.app):
+                flusher = asyncio.create_task(projects.run_flusher(0.01))
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://stress", timeout=60) as client:
+                    project_id = projects.create_project("stress").id
+                    stop = asyncio.Event()
+                    errors = []
+                    reader_tasks = [asyncio.create_task(readers(client, project_id, stop, errors)) for _ in range(args.readers)]
+
+                    started = time.perf_counter()
+                    submits = [
+                        client.post("/api/generate", json={"project_id": project_id, "params": make_params(i, "t2i_sdxl")})
+                        for i in range(args.generations)
+                    ]
+                    node_ids = [r.json()["id"] for r in await asyncio.gather(*submits)]
+
+                    # Cancel a few while they are sampling
+                    await asyncio.sleep(args.step_time * args.steps / 2)
+                    cancelled = set(random.sample(node_ids, min(args.cancel, len(node_ids))))
+                    for node_id in list(cancelled):
+                        r = await client.post(f"/api/jobs/{node_id}/cancel")
+                        if r.status_code != 200:
+                            # Already finished; not a cancellation after all
+                            cancelled.discard(node_id)
+
+                    deadline = time.monotonic() + args.timeout
+                    while time.monotonic() < deadline:
+                        if all(projects.get_node(project_id, n).status != "generating" for n in node_ids):
+                            break
+                        await asyncio.sleep(0.05)
+                    wall = time.perf_counter() - started
+                    stop.set()
+                    reads = sum(await asyncio.gather(*reader_tasks))
+                flusher.cancel()
+                try:
+                    await flusher
+                except asyncio.CancelledError:
+                    pass
+
+            p = projects.load_project(project_id)
+            problems = errors + check(p, node_ids, cancelled, "memory")
+            # Drop the resident copy and read back what reached the disk
+            projects.PROJECT_CACHE.clear()
+            projects.NODE_INDEXES.clear()
+            problems += check(projects.load_project(project_id), node_ids, cancelled, "disk")
+
+            shutdown = await check_shutdown(args)
+            problems += shutdown["problems"]
+    finally:
+        fake.stop()
+
+    return {
+        "generations": args.generations,
+        "cancelled": len(cancelled),
+        "wall_seconds": round(wall, 3),
+        "reads": reads,
+        "project_revision": p.revision,
+        "shutdown_seconds": shutdown.get("seconds"),
+        "problems": problems,
+        "ok": not problems,
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Concurrent generation stress test for one project")
+    parser.add_argument("--generations", type=int, default=100)
+    parser.add_argument("--cancel", type=int, default=5, help="Jobs to cancel mid-run")
+    parser.add_argument("--readers", type=int, default=4, help="Concurrent clients reading the project")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--step-time", type=float, default=0.02)
+    parser.add_argument("--output-kb", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=100, help="Prompts the fake executes concurrently")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    sys.exit(0 if report["ok"] else 1)
+
+if __name__ == "__main__":
+    main_cli()
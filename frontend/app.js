@@ -8,6 +8,7 @@ let activeNodeId = null;
 let availableModels = { checkpoints: [], unets: [], loras: [] };
 let currentTemplates = { characters: [], locations: [], environments: [], styles: [] };
 let availableWorkflows = {};
+let projectEvents = null;
 
 // DOM Elements
 const viewWorkspace = document.getElementById('view-workspace');
@@ -87,6 +88,8 @@ const randStyle = document.getElementById('rand-style');
 const activeImage = document.getElementById('active-image');
 const canvasPlaceholder = document.getElementById('canvas-placeholder');
 const generationLoader = document.getElementById('generation-loader');
+const generationPreview = document.getElementById('generation-preview');
+const btnCancelGeneration = document.getElementById('btn-cancel-generation');
 
 // Initialization
 document.addEventListener('DOMContentLoaded', async () => {
@@ -341,6 +344,16 @@ function initEvents() {
         }
     });
 
+    btnCancelGeneration.addEventListener('click', async () => {
+        if (!activeNodeId) return;
+        try {
+            // The resulting 'error' event updates the node and the canvas
+            await fetch(`${API_URL}/jobs/${activeNodeId}/cancel`, { method: 'POST' });
+        } catch (e) {
+            console.error("Failed to cancel generation", e);
+        }
+    });
+
     elWidth.addEventListener('input', updateDimensions);
     elAspectRatio.addEventListener('change', updateDimensions);
     elOrientation.addEventListener('change', updateDimensions);
@@ -520,15 +533,10 @@ async function loadDashboard() {
             const el = document.createElement('div');
             el.className = 'project-card';
 
-            // Get latest image if exists
+            // Latest finished image, as tracked by the project index
             let thumbUrl = '';
-            const nodeIds = Object.keys(p.nodes);
-            if (nodeIds.length > 0) {
-                // Find latest node
-                const nodes = Object.values(p.nodes).sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp));
-                if (nodes[0].image_filename) {
-                    thumbUrl = `${API_URL}/projects/${p.id}/images/${nodes[0].image_filename}`;
-                }
+            if (p.thumbnail) {
+                thumbUrl = `${API_URL}/projects/${p.id}/images/${p.thumbnail}?size=thumb`;
             }
 
             const thumbStyle = thumbUrl ? `background-image: url('${thumbUrl}')` : '';
@@ -538,7 +546,7 @@ async function loadDashboard() {
                 <div class="project-thumb" style="${thumbStyle}">${thumbIcon}</div>
                 <div class="project-info">
                     <h3>${p.name}</h3>
-                    <p>${nodeIds.length} generations</p>
+                    <p>${p.node_count} generations</p>
                 </div>
             `;
 
@@ -572,6 +580,7 @@ async function openProject(id) {
         const res = await fetch(`${API_URL}/projects/${id}`);
         currentProject = await res.json();
         labelCurrentProject.textContent = currentProject.name;
+        subscribeToProject(currentProject.id);
 
         // Rebuild timeline structure (simple linear for now, based on timestamps)
         currentTimeline = Object.values(currentProject.nodes).sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
@@ -723,7 +732,7 @@ function renderTimeline() {
 
         let thumbUrl = '';
         if (visibleNode.image_filename && visibleNode.status === 'completed') {
-            thumbUrl = `${API_URL}/projects/${currentProject.id}/images/${visibleNode.image_filename}`;
+            thumbUrl = `${API_URL}/projects/${currentProject.id}/images/${visibleNode.image_filename}?size=thumb`;
         }
 
         const thumbStyle = thumbUrl ? `background-image: url('${thumbUrl}')` : '';
@@ -797,6 +806,8 @@ function selectNode(id) {
 
     generationLoader.style.display = 'none';
     if (errorOverlay) errorOverlay.style.display = 'none';
+    // Previews are per node; the next 'preview' event shows this node's latest frame
+    showGenerationPreview(null);
 
     if (node.status === 'error') {
         if (errorOverlay) {
@@ -984,9 +995,11 @@ async function generateImage() {
 
         const newNode = await res.json();
 
-        // Optimistically add to timeline
-        currentProject.nodes[newNode.id] = newNode;
-        currentTimeline.push(newNode);
+        // Optimistically add to timeline (the 'queued' event may have beaten us here)
+        if (!currentProject.nodes[newNode.id]) {
+            currentProject.nodes[newNode.id] = newNode;
+            currentTimeline.push(newNode);
+        }
 
         if (!slideshowActive) {
             selectNode(newNode.id);
@@ -994,60 +1007,132 @@ async function generateImage() {
             renderTimeline();
         }
 
-        // Poll for completion
-        pollForCompletion(newNode.id);
-
     } catch (e) {
         console.error("Generation failed", e);
         generationLoader.style.display = 'none';
     }
 }
 
-function pollForCompletion(nodeId) {
-    const interval = setInterval(async () => {
+function subscribeToProject(projectId) {
+    if (projectEvents) projectEvents.close();
+    // Revision to resync from on the next open: the one just loaded, so events published between
+    // the project fetch and the first connection aren't lost, then the one seen before a drop
+    let resyncFrom = currentProject && currentProject.id === projectId ? (currentProject.revision || 0) : null;
+    projectEvents = new EventSource(`${API_URL}/projects/${projectId}/events`);
+
+    projectEvents.onopen = async () => {
+        // Events sent while not connected are lost, so fetch what changed since then
+        if (resyncFrom === null || !currentProject || currentProject.id !== projectId) return;
+        let since = resyncFrom;
+        resyncFrom = null;
         try {
-            const res = await fetch(`${API_URL}/projects/${currentProject.id}`);
-            const p = await res.json();
-            const node = p.nodes[nodeId];
-
-            if (node.status === 'completed' && node.image_filename) {
-                clearInterval(interval);
-                currentProject = p;
-                currentTimeline = Object.values(currentProject.nodes).sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
-                if (activeNodeId === nodeId || slideshowActive) {
-                    selectNode(nodeId);
-                }
+            while (true) {
+                const res = await fetch(`${API_URL}/projects/${projectId}/nodes?since=${since}&limit=500`);
+                const page = await res.json();
+                for (const node of page.nodes) currentProject.nodes[node.id] = node;
+                since = page.revision;
+                if (!page.has_more) break;
+            }
+            currentProject.revision = Math.max(currentProject.revision || 0, since);
+            currentTimeline = Object.values(currentProject.nodes).sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
+            if (activeNodeId) selectNode(activeNodeId);
+        } catch (e) {
+            console.error("Failed to resync project", e);
+        }
+    };
+    projectEvents.onerror = (e) => {
+        // Node 'error' events carry data; only connection errors mark a resync
+        if (e.data) return;
+        if (resyncFrom === null && currentProject) resyncFrom = currentProject.revision || 0;
+    };
 
-                // Auto-Iterate if Slideshow is active
-                if (slideshowActive) {
-                    const delaySecs = parseInt(inputSlideshowDelay.value) || 5;
-                    slideshowTimeout = setTimeout(async () => {
-                        if (slideshowActive) {
-                            if (!randSeed.checked) {
-                                const currentSeed = parseInt(elSeed.value) || 0;
-                                elSeed.value = currentSeed + 1;
-                            }
-                            await generateImage();
-                        }
-                    }, delaySecs * 1000);
-                }
+    projectEvents.addEventListener('progress', (e) => {
+        const ev = JSON.parse(e.data);
+        const node = currentProject && currentProject.nodes[ev.node_id];
+        if (!node) return;
+        node.progress = ev.progress;
+        if (activeNodeId === ev.node_id && node.status === 'generating') {
+            const pct = Math.round((node.progress || 0) * 100);
+            const progressText = document.getElementById('generation-progress-text');
+            if (progressText) progressText.textContent = `Generating... ${pct}%`;
+        }
+    });
 
-            } else if (node.status === 'error') {
-                clearInterval(interval);
-                currentProject = p;
-                currentTimeline = Object.values(currentProject.nodes).sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
-                if (activeNodeId === nodeId || slideshowActive) {
-                    selectNode(nodeId);
-                }
-            } else if (node.status === 'generating') {
-                if (activeNodeId === nodeId) {
-                    const pct = Math.round((node.progress || 0) * 100);
-                    const progressText = document.getElementById('generation-progress-text');
-                    if (progressText) progressText.textContent = `Generating... ${pct}%`;
+    projectEvents.addEventListener('preview', (e) => {
+        const ev = JSON.parse(e.data);
+        const node = currentProject && currentProject.nodes[ev.node_id];
+        if (!node || activeNodeId !== ev.node_id || node.status !== 'generating') return;
+        showGenerationPreview(`${API_URL}/projects/${projectId}/nodes/${ev.node_id}/preview?rev=${ev.rev}`);
+    });
+
+    const applyNode = (e) => {
+        const ev = JSON.parse(e.data);
+        if (!currentProject || currentProject.id !== projectId) return null;
+        const isNew = !currentProject.nodes[ev.node_id];
+        currentProject.nodes[ev.node_id] = ev.node;
+        currentProject.revision = Math.max(currentProject.revision || 0, ev.node.revision || 0);
+        if (isNew) {
+            currentTimeline.push(ev.node);
+        } else {
+            currentTimeline = currentTimeline.map(n => n.id === ev.node_id ? ev.node : n);
+        }
+        return ev.node;
+    };
+
+    projectEvents.addEventListener('queued', (e) => {
+        if (applyNode(e)) renderTimeline();
+    });
+    projectEvents.addEventListener('completed', (e) => {
+        const node = applyNode(e);
+        if (node) onNodeFinished(node);
+    });
+    projectEvents.addEventListener('error', (e) => {
+        // EventSource also fires a data-less 'error' on connection problems
+        if (!e.data) return;
+        const node = applyNode(e);
+        if (node) onNodeFinished(node);
+    });
+}
+
+function showGenerationPreview(url) {
+    const spinner = generationLoader.querySelector('.spinner');
+    generationPreview.dataset.pending = url || '';
+    if (!url) {
+        generationPreview.style.display = 'none';
+        generationPreview.removeAttribute('src');
+        if (spinner) spinner.style.display = '';
+        return;
+    }
+    // Keep showing the previous frame until the next one has loaded
+    const img = new Image();
+    img.onload = () => {
+        // Dropped if a newer frame was requested or the node finished meanwhile
+        if (generationPreview.dataset.pending !== url) return;
+        generationPreview.src = url;
+        generationPreview.style.display = 'block';
+        if (spinner) spinner.style.display = 'none';
+    };
+    img.src = url;
+}
+
+function onNodeFinished(node) {
+    if (activeNodeId === node.id || slideshowActive) {
+        selectNode(node.id);
+    } else {
+        renderTimeline();
+    }
+
+    // Auto-Iterate if Slideshow is active
+    if (node.status === 'completed' && slideshowActive) {
+        const delaySecs = parseInt(inputSlideshowDelay.value) || 5;
+        slideshowTimeout = setTimeout(async () => {
+            if (slideshowActive) {
+                if (!randSeed.checked) {
+                    const currentSeed = parseInt(elSeed.value) || 0;
+                    elSeed.value = currentSeed + 1;
                 }
+                await generateImage();
             }
-        } catch (e) {
-            console.error(e);
-        }
-    }, 2000);
+        }, delaySecs * 1000);
+    }
 }